@@ -1,5 +1,19 @@
 from __future__ import annotations
 
+import mmap
+import os
+import struct
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # Optional, only needed for the vectorized decoding.
+    np = None
+
 HASH_LEN = 20
 CRC32_LEN = 4
 OFFSET_32_LEN = 4
@@ -69,3 +83,531 @@ def parse_git_idx(data: bytes):
         crc_32_checksums,
         offsets,
     )
+
+
+IDX_SIGNATURE = b"\xfftOc"
+HEADER_LEN = 8
+FANOUT_LEN = 256 * 4
+TRAILER_LEN = 2 * HASH_LEN
+# Version 1 indexes store (offset, hash) pairs instead of separate tables.
+V1_ENTRY_LEN = OFFSET_32_LEN + HASH_LEN
+
+RIDX_SIGNATURE = b"RIDX"
+RIDX_VERSION = 1
+# signature, version, hash function id
+RIDX_HEADER = struct.Struct(">4sII")
+
+_UINT32 = struct.Struct(">I")
+_UINT64 = struct.Struct(">Q")
+
+IdxEntry = namedtuple("IdxEntry", "index, offset, crc32")
+PackedObject = namedtuple("PackedObject", "index, offset, size")
+
+
+class IdxArrays(namedtuple("IdxArrays", "fanout, hashes, crc32s, offsets")):
+    """Whole .idx tables decoded as NumPy arrays, see `PackIndex.arrays()`."""
+
+    __slots__ = ()
+
+    def as_parsed(self):
+        """Convert to the same tuple that `parse_git_idx` returns."""
+        fanout = dict(enumerate(self.fanout.tolist()))
+        hash_bytes = self.hashes.tobytes()
+        hashes = [hash_bytes[i : i + HASH_LEN] for i in range(0, len(hash_bytes), HASH_LEN)]
+        if self.crc32s is None:
+            crcs = [None] * len(hashes)
+        else:
+            crc_bytes = self.crc32s.astype(">u4").tobytes()
+            crcs = [crc_bytes[i : i + CRC32_LEN] for i in range(0, len(crc_bytes), CRC32_LEN)]
+        return fanout, hashes, crcs, self.offsets.tolist()
+
+
+class AmbiguousPrefixError(LookupError):
+    """An abbreviated SHA matches more than one object."""
+
+    def __init__(self, prefix: str, candidates: list[bytes]) -> None:
+        self.prefix = prefix
+        self.candidates = candidates
+        listing = ", ".join(sha.hex() for sha in candidates)
+        super().__init__(f"Short SHA {prefix} is ambiguous, candidates: {listing}")
+
+
+def binary_sha(sha: bytes | str) -> bytes:
+    """Accept a SHA-1 either as 20 raw bytes or as a 40 character hex string."""
+    if isinstance(sha, str):
+        sha = bytes.fromhex(sha)
+    if len(sha) != HASH_LEN:
+        raise ValueError(f"Expected a {HASH_LEN} byte SHA-1, got {len(sha)} bytes")
+    return sha
+
+
+class UInt32Table:
+    """Read-only sequence of big-endian uint32 values stored in a buffer.
+
+    Values are decoded on access, nothing is copied out of the buffer. With a
+    `stride` larger than 4, the values are interleaved with other data.
+    """
+
+    __slots__ = ("_buf", "_stride")
+
+    def __init__(self, buf: memoryview, stride: int = 4) -> None:
+        self._buf = buf
+        self._stride = stride
+
+    def __len__(self) -> int:
+        return len(self._buf) // self._stride
+
+    def __getitem__(self, idx: int) -> int:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("table index out of range")
+        return _UINT32.unpack_from(self._buf, idx * self._stride)[0]
+
+    def release(self) -> None:
+        self._buf.release()
+
+
+class HashTable:
+    """Read-only sequence of binary hashes stored in a buffer.
+
+    Supports `bisect`, since the hashes in pack indexes are sorted. Hashes are
+    `stride` bytes apart and start `start` bytes into each record.
+    """
+
+    __slots__ = ("_buf", "_stride", "_start")
+
+    def __init__(self, buf: memoryview, stride: int = HASH_LEN, start: int = 0) -> None:
+        self._buf = buf
+        self._stride = stride
+        self._start = start
+
+    def __len__(self) -> int:
+        return len(self._buf) // self._stride
+
+    def __getitem__(self, idx: int) -> bytes:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("table index out of range")
+        start = idx * self._stride + self._start
+        return bytes(self._buf[start : start + HASH_LEN])
+
+    def __iter__(self):
+        buf = self._buf
+        for start in range(self._start, len(buf), self._stride):
+            yield bytes(buf[start : start + HASH_LEN])
+
+    def release(self) -> None:
+        self._buf.release()
+
+
+class _PackOrderOffsets:
+    """Offsets in pack order, looked up through a reverse index."""
+
+    __slots__ = ("_positions", "_index")
+
+    def __init__(self, positions, index: PackIndex) -> None:
+        self._positions = positions
+        self._index = index
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __getitem__(self, pack_pos: int) -> int:
+        return self._index.offset(self._positions[pack_pos])
+
+
+class ReverseIndex:
+    """Maps pack order (ascending offsets) to index positions.
+
+    `positions[n]` is the index position of the object stored n-th in the
+    pack and `offsets[n]` is its offset. Both support `bisect`.
+    """
+
+    def __init__(self, positions, offsets, data: mmap.mmap | None = None) -> None:
+        self.positions = positions
+        self.offsets = offsets
+        self._data = data
+
+    @classmethod
+    def read(cls, path: str | os.PathLike, index: PackIndex) -> ReverseIndex:
+        """Map a .rev file written by git for the given index."""
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            signature, version, hash_id = RIDX_HEADER.unpack_from(data)
+            if signature != RIDX_SIGNATURE or version != RIDX_VERSION or hash_id != 1:
+                raise ValueError(f"Not a version 1 SHA-1 reverse index: {path}")
+
+            positions_end = RIDX_HEADER.size + len(index) * 4
+            if len(data) != positions_end + TRAILER_LEN:
+                raise ValueError(f"Reverse index size doesn't match the pack index: {path}")
+            if data[positions_end : positions_end + HASH_LEN] != index.pack_checksum:
+                raise ValueError(f"Reverse index belongs to a different pack: {path}")
+        except (ValueError, struct.error):
+            data.close()
+            raise
+
+        positions = UInt32Table(memoryview(data)[RIDX_HEADER.size : positions_end])
+        return cls(positions, _PackOrderOffsets(positions, index), data)
+
+    @classmethod
+    def build(cls, index: PackIndex) -> ReverseIndex:
+        """Compute the reverse index with a single sort of the offsets."""
+        if np is not None:
+            offsets = index.arrays().offsets
+            order = np.argsort(offsets, kind="stable")
+            positions = array("I", order.astype(np.uint32).tobytes())
+            sorted_offsets = array("Q", offsets[order].astype(np.uint64).tobytes())
+            return cls(positions, sorted_offsets)
+
+        offsets = array("Q", map(index.offset, range(len(index))))
+        positions = array("I", sorted(range(len(offsets)), key=offsets.__getitem__))
+        sorted_offsets = array("Q", map(offsets.__getitem__, positions))
+        return cls(positions, sorted_offsets)
+
+    def close(self) -> None:
+        if self._data is not None:
+            self.positions.release()
+            self._data.close()
+
+
+class MappedIndex(ABC):
+    """Base for memory-mapped index files with a fanout and a sorted SHA table.
+
+    Subclasses parse the buffer into `fanout` and `hashes` and describe an
+    object with `entry()`. Lookups by full and abbreviated SHA are shared.
+    Use `open()` to map a file, or pass any bytes-like object directly.
+    """
+
+    fanout: UInt32Table
+    hashes: HashTable
+
+    def __init__(self, data, path: str | os.PathLike | None = None) -> None:
+        self.path = Path(path) if path is not None else None
+        self._data = data
+        self._view = memoryview(data)
+        self._tables: list = []
+
+    def _table(self, table):
+        """Register a table or a buffer slice to be released on `close()`."""
+        self._tables.append(table)
+        return table
+
+    @classmethod
+    def open(cls, path: str | os.PathLike):
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, path)
+
+    def close(self) -> None:
+        """Release the buffer views and unmap the file, if it was mapped."""
+        for table in self._tables:
+            table.release()
+        self._view.release()
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.path or '<buffer>'} ({len(self)} objects)>"
+
+    def _check_index(self, idx: int) -> int:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("object index out of range")
+        return idx
+
+    def sha(self, idx: int) -> bytes:
+        """Binary SHA-1 of the `idx`-th object, in sorted order."""
+        return self.hashes[self._check_index(idx)]
+
+    @abstractmethod
+    def entry(self, idx: int):
+        """Description of the `idx`-th object, in sorted order."""
+
+    def _fanout_range(self, first_byte: int) -> tuple[int, int]:
+        """Range of object indexes whose SHA starts with the given byte."""
+        lo = self.fanout[first_byte - 1] if first_byte else 0
+        return lo, self.fanout[first_byte]
+
+    def find(self, sha: bytes | str) -> int | None:
+        """Index of the object with the given SHA, or `None` if not present."""
+        sha = binary_sha(sha)
+        lo, hi = self._fanout_range(sha[0])
+        idx = bisect_left(self.hashes, sha, lo, hi)
+        if idx < hi and self.hashes[idx] == sha:
+            return idx
+        return None
+
+    def lookup(self, sha: bytes | str):
+        """Find an object by its SHA. Raises `KeyError` if it isn't indexed."""
+        idx = self.find(sha)
+        if idx is None:
+            raise KeyError(sha)
+        return self.entry(idx)
+
+    def lookup_many(self, shas) -> dict:
+        """Look up many SHAs at once.
+
+        The queries are sorted and walked together with the sorted hash table,
+        each search starting where the previous one ended. Returns a dict
+        keyed by binary SHA; SHAs that aren't indexed are left out.
+        """
+        found = {}
+        idx = 0
+        for sha in sorted(set(map(binary_sha, shas))):
+            lo, hi = self._fanout_range(sha[0])
+            idx = bisect_left(self.hashes, sha, max(idx, lo), hi)
+            if idx < hi and self.hashes[idx] == sha:
+                found[sha] = self.entry(idx)
+        return found
+
+    def _prefix_range(self, hex_prefix: str) -> tuple[int, int]:
+        """Index range of the objects whose SHA starts with `hex_prefix`."""
+        if not 0 < len(hex_prefix) <= 2 * HASH_LEN:
+            raise ValueError(f"Invalid SHA prefix length: {hex_prefix!r}")
+        low = bytes.fromhex(hex_prefix.ljust(2 * HASH_LEN, "0"))
+        high = bytes.fromhex(hex_prefix.ljust(2 * HASH_LEN, "f"))
+
+        lo, _ = self._fanout_range(low[0])
+        _, hi = self._fanout_range(high[0])
+        start = bisect_left(self.hashes, low, lo, hi)
+        end = bisect_right(self.hashes, high, start, hi)
+        return start, end
+
+    def prefix_matches(self, hex_prefix: str) -> list[bytes]:
+        """All SHAs starting with the given hex digits."""
+        start, end = self._prefix_range(hex_prefix)
+        return [self.hashes[idx] for idx in range(start, end)]
+
+    def resolve_prefix(self, hex_prefix: str) -> bytes:
+        """Expand an abbreviated hex SHA to the full binary SHA.
+
+        Raises `KeyError` if no object matches and `AmbiguousPrefixError` if
+        more than one does.
+        """
+        start, end = self._prefix_range(hex_prefix)
+        if start == end:
+            raise KeyError(hex_prefix)
+        if end - start > 1:
+            raise AmbiguousPrefixError(hex_prefix, self.prefix_matches(hex_prefix))
+        return self.hashes[start]
+
+    def abbrev_len(self, minimum: int = 4) -> int:
+        """Shortest hex length that abbreviates every SHA in the index uniquely.
+
+        Neighbours in the sorted table share the longest prefixes, so a single
+        pass comparing each SHA with the next one is enough.
+        """
+        longest_common = 0
+        prev = None
+        for sha in self.hashes:
+            sha = int.from_bytes(sha, "big")
+            if prev is not None:
+                common = (HASH_LEN * 8 - (prev ^ sha).bit_length()) // 4
+                longest_common = max(longest_common, common)
+            prev = sha
+        return max(minimum, longest_common + 1)
+
+
+class PackIndex(MappedIndex):
+    """Lazily decoded, memory-mapped pack index, version 1 or 2.
+
+    Each table of the .idx file is kept as a `memoryview` slice of the mapping
+    and single entries are decoded only when asked for, so opening an index
+    takes the same time regardless of the number of objects in the pack.
+    """
+
+    def __init__(self, data, path: str | os.PathLike | None = None) -> None:
+        super().__init__(data, path)
+        view = self._view
+
+        # Version 1 has no header, the magic number can't be a valid fanout
+        # entry though.
+        if bytes(view[: len(IDX_SIGNATURE)]) == IDX_SIGNATURE:
+            self.version = _UINT32.unpack_from(view, len(IDX_SIGNATURE))[0]
+            if self.version != 2:
+                raise ValueError(f"Unsupported pack index version: {self.version}")
+            fanout_start = HEADER_LEN
+        else:
+            self.version = 1
+            fanout_start = 0
+
+        fanout_end = fanout_start + FANOUT_LEN
+        if len(view) < fanout_end + TRAILER_LEN:
+            raise ValueError("Truncated pack index")
+        self.fanout = self._table(UInt32Table(view[fanout_start:fanout_end]))
+        count = self.fanout[255]
+
+        if self.version == 1:
+            entries_end = fanout_end + count * V1_ENTRY_LEN
+            if len(view) < entries_end + TRAILER_LEN:
+                raise ValueError("Truncated pack index")
+
+            entries = view[fanout_end:entries_end]
+            self.hashes = self._table(HashTable(entries, V1_ENTRY_LEN, OFFSET_32_LEN))
+            self._offsets_32 = self._table(UInt32Table(entries, V1_ENTRY_LEN))
+            self._crcs = None
+            self._offsets_64 = None
+        else:
+            hashes_end = fanout_end + count * HASH_LEN
+            crcs_end = hashes_end + count * CRC32_LEN
+            offsets_32_end = crcs_end + count * OFFSET_32_LEN
+            if len(view) < offsets_32_end + TRAILER_LEN:
+                raise ValueError("Truncated pack index")
+
+            self.hashes = self._table(HashTable(view[fanout_end:hashes_end]))
+            self._crcs = self._table(UInt32Table(view[hashes_end:crcs_end]))
+            self._offsets_32 = self._table(UInt32Table(view[crcs_end:offsets_32_end]))
+            self._offsets_64 = self._table(view[offsets_32_end : len(view) - TRAILER_LEN])
+
+        self._trailer = self._table(view[len(view) - TRAILER_LEN :])
+        self._reverse_index: ReverseIndex | None = None
+        self._pack_size: int | None = None
+
+    def close(self) -> None:
+        if self._reverse_index is not None:
+            self._reverse_index.close()
+        super().close()
+
+    def crc32(self, idx: int) -> int | None:
+        """CRC-32 of the packed (compressed) data of the `idx`-th object.
+
+        Version 1 indexes don't store these, `None` is returned instead.
+        """
+        idx = self._check_index(idx)
+        if self._crcs is None:
+            return None
+        return self._crcs[idx]
+
+    def offset(self, idx: int) -> int:
+        """Offset of the `idx`-th object in the .pack file."""
+        offset = self._offsets_32[self._check_index(idx)]
+
+        # MSB set means that the rest is an index into the 64-bit offset table.
+        if self._offsets_64 is not None and offset & (1 << 31):
+            offset_64_idx = offset & ~(1 << 31)
+            offset = _UINT64.unpack_from(self._offsets_64, offset_64_idx * OFFSET_64_LEN)[0]
+
+        return offset
+
+    def entry(self, idx: int) -> IdxEntry:
+        return IdxEntry(idx, self.offset(idx), self.crc32(idx))
+
+    @property
+    def pack_checksum(self) -> bytes:
+        """SHA-1 of the corresponding .pack file, as stored in the trailer."""
+        return bytes(self._trailer[:HASH_LEN])
+
+    @property
+    def checksum(self) -> bytes:
+        """SHA-1 of the index file contents preceding it."""
+        return bytes(self._trailer[HASH_LEN:])
+
+    @property
+    def pack_path(self) -> Path | None:
+        return self.path.with_suffix(".pack") if self.path is not None else None
+
+    @property
+    def reverse_index(self) -> ReverseIndex:
+        """Pack order of the objects.
+
+        Read from the .rev file next to the index if git wrote one, built
+        with a single sort otherwise. Either way this is done only once.
+        """
+        if self._reverse_index is None:
+            rev_path = self.path.with_suffix(".rev") if self.path is not None else None
+            if rev_path is not None and rev_path.exists():
+                self._reverse_index = ReverseIndex.read(rev_path, self)
+            else:
+                self._reverse_index = ReverseIndex.build(self)
+        return self._reverse_index
+
+    @property
+    def pack_size(self) -> int:
+        """Size of the .pack file, needed to size the last object in it."""
+        if self._pack_size is None:
+            if self.pack_path is None:
+                raise ValueError("Pack size unknown for an index not read from a file")
+            self._pack_size = self.pack_path.stat().st_size
+        return self._pack_size
+
+    @pack_size.setter
+    def pack_size(self, size: int) -> None:
+        self._pack_size = size
+
+    def offset_to_index(self, offset: int) -> int:
+        """Index position of the object starting at the given pack offset."""
+        rev = self.reverse_index
+        pack_pos = bisect_left(rev.offsets, offset)
+        if pack_pos == len(rev.offsets) or rev.offsets[pack_pos] != offset:
+            raise KeyError(offset)
+        return rev.positions[pack_pos]
+
+    def _size_at(self, pack_pos: int, offset: int) -> int:
+        offsets = self.reverse_index.offsets
+        if pack_pos + 1 < len(offsets):
+            return offsets[pack_pos + 1] - offset
+        # The last object ends where the pack trailer begins.
+        return self.pack_size - HASH_LEN - offset
+
+    def compressed_size(self, idx: int) -> int:
+        """Number of bytes the `idx`-th object takes in the pack, header included."""
+        offset = self.offset(idx)
+        pack_pos = bisect_left(self.reverse_index.offsets, offset)
+        return self._size_at(pack_pos, offset)
+
+    def iter_pack_order(self):
+        """Yield a `PackedObject` for each object, in the order of the pack."""
+        rev = self.reverse_index
+        offsets = rev.offsets
+        for pack_pos, idx in enumerate(rev.positions):
+            offset = offsets[pack_pos]
+            yield PackedObject(idx, offset, self._size_at(pack_pos, offset))
+
+    def arrays(self) -> IdxArrays:
+        """Decode all tables at once with NumPy.
+
+        The fanout and CRC-32 tables are big-endian `uint32` arrays, the hashes
+        an `(n, 20)` `uint8` array. These are views into the index buffer and
+        have to be dropped before `close()`. The offsets are a `uint64` copy,
+        with the MSB-flagged entries gathered from the 64-bit table in one go.
+        Version 1 indexes have no CRC-32 table, `crc32s` is `None` for them.
+        """
+        if np is None:
+            raise ImportError("PackIndex.arrays() requires NumPy")
+
+        fanout = np.frombuffer(self.fanout._buf, dtype=">u4")
+
+        if self.version == 1:
+            entries = np.frombuffer(self.hashes._buf, dtype=np.uint8).reshape(-1, V1_ENTRY_LEN)
+            hashes = entries[:, OFFSET_32_LEN:]
+            offsets = entries[:, :OFFSET_32_LEN].copy().view(">u4").ravel().astype(np.uint64)
+            return IdxArrays(fanout, hashes, None, offsets)
+
+        hashes = np.frombuffer(self.hashes._buf, dtype=np.uint8).reshape(-1, HASH_LEN)
+        crc32s = np.frombuffer(self._crcs._buf, dtype=">u4")
+
+        offsets = np.frombuffer(self._offsets_32._buf, dtype=">u4").astype(np.uint64)
+        large = (offsets & (1 << 31)) != 0
+        if large.any():
+            offsets_64 = np.frombuffer(self._offsets_64, dtype=">u8")
+            offsets[large] = offsets_64[offsets[large] & ~np.uint64(1 << 31)]
+
+        return IdxArrays(fanout, hashes, crc32s, offsets)
+
+
+def parse_git_idx_numpy(data) -> IdxArrays:
+    """Vectorized counterpart of `parse_git_idx`, see `PackIndex.arrays()`."""
+    return PackIndex(data).arrays()
@@ -0,0 +1,155 @@
+"""
+Writes a version 2 .idx for a bare .pack file, like `git index-pack` does.
+
+The pack is scanned once to find object boundaries and CRC-32s, then every
+object is rebuilt and hashed on a process pool. Objects deltified against a
+REF_DELTA base whose SHA isn't known yet are retried in further rounds, once
+their bases have been hashed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from idx_file_reader import IDX_SIGNATURE
+from pack_reader import OBJ_REF_DELTA, PackFile
+
+IDX_VERSION = 2
+# Offsets above this go to the 64-bit table, same as git's default.
+OFFSET_32_LIMIT = 0x7FFFFFFF
+BATCH_OBJECTS = 4096
+
+# Per-process state of the pool workers, see `_init_worker`.
+_worker_pack: PackFile | None = None
+
+
+def _init_worker(pack_path: Path, ref_offsets: dict[bytes, int]) -> None:
+    global _worker_pack
+    _worker_pack = PackFile(pack_path, resolve_ref=ref_offsets.__getitem__)
+
+
+def _hash_batch(offsets: array) -> list[tuple[int, bytes | None]]:
+    """SHA-1 of each object; `None` where a REF_DELTA base isn't known yet."""
+    hashed = []
+    for offset in offsets:
+        try:
+            type_name, data = _worker_pack.read_object(offset)
+        except KeyError:
+            hashed.append((offset, None))
+            continue
+        sha = hashlib.sha1(f"{type_name} {len(data)}\0".encode())
+        sha.update(data)
+        hashed.append((offset, sha.digest()))
+    return hashed
+
+
+def build_idx(entries: list[tuple[bytes, int, int]], pack_checksum: bytes) -> bytes:
+    """Serialize (sha, crc32, offset) entries as a version 2 pack index."""
+    entries = sorted(entries)
+
+    fanout = [0] * 256
+    for sha, _, _ in entries:
+        fanout[sha[0]] += 1
+    total = 0
+    for first_byte, count in enumerate(fanout):
+        total += count
+        fanout[first_byte] = total
+
+    offsets_32 = []
+    offsets_64 = []
+    for _, _, offset in entries:
+        if offset > OFFSET_32_LIMIT:
+            offsets_32.append((1 << 31) | len(offsets_64))
+            offsets_64.append(offset)
+        else:
+            offsets_32.append(offset)
+
+    count = len(entries)
+    data = b"".join(
+        (
+            IDX_SIGNATURE,
+            struct.pack(">I", IDX_VERSION),
+            struct.pack(">256I", *fanout),
+            b"".join(sha for sha, _, _ in entries),
+            struct.pack(f">{count}I", *(crc for _, crc, _ in entries)),
+            struct.pack(f">{count}I", *offsets_32),
+            struct.pack(f">{len(offsets_64)}Q", *offsets_64),
+            pack_checksum,
+        )
+    )
+    return data + hashlib.sha1(data).digest()
+
+
+def _batches(offsets: list[int], size: int):
+    for start in range(0, len(offsets), size):
+        yield array("Q", offsets[start : start + size])
+
+
+def index_pack(
+    pack_path: str | os.PathLike,
+    max_workers: int | None = None,
+    batch_objects: int = BATCH_OBJECTS,
+) -> bytes:
+    """Compute the version 2 .idx contents for a pack."""
+    pack_path = Path(pack_path)
+
+    crcs = {}
+    ref_bases = set()
+    with PackFile(pack_path) as pack:
+        for offset, header, end in pack.iter_objects():
+            crcs[offset] = pack.crc32(offset, end)
+            if header.type == OBJ_REF_DELTA:
+                ref_bases.add(bytes(header.base))
+        pack_checksum = pack.checksum
+
+    shas: dict[int, bytes] = {}
+    ref_offsets: dict[bytes, int] = {}
+    pending = list(crcs)
+    while pending:
+        # Workers only get to know the REF_DELTA bases hashed in earlier rounds.
+        with ProcessPoolExecutor(
+            max_workers, initializer=_init_worker, initargs=(pack_path, ref_offsets)
+        ) as pool:
+            results = pool.map(_hash_batch, _batches(pending, batch_objects))
+            unresolved = []
+            for batch in results:
+                for offset, sha in batch:
+                    if sha is None:
+                        unresolved.append(offset)
+                    else:
+                        shas[offset] = sha
+
+        if len(unresolved) == len(pending):
+            raise ValueError(f"{len(unresolved)} objects have REF_DELTA bases outside the pack")
+        pending = unresolved
+        ref_offsets = {sha: offset for offset, sha in shas.items() if sha in ref_bases}
+
+    entries = [(shas[offset], crc, offset) for offset, crc in crcs.items()]
+    return build_idx(entries, pack_checksum)
+
+
+USAGE = f"Usage: {sys.argv[0]} <pack_file> [<idx_file>]"
+MAXARGS = 3
+MINARGS = 2
+
+
+def main(args: list[str]):
+    pack_path = Path(args[0])
+    idx_path = Path(args[1]) if len(args) > 1 else pack_path.with_suffix(".idx")
+    idx_path.write_bytes(index_pack(pack_path))
+    print(f"Wrote {idx_path}")
+
+
+if __name__ == "__main__":
+    if not (MINARGS <= len(sys.argv) <= MAXARGS):
+        print(USAGE)
+        sys.exit(1)
+
+    sys.argv.pop(0)
+    main(sys.argv)
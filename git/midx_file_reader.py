@@ -0,0 +1,123 @@
+"""
+Reader for git's multi-pack-index (.git/objects/pack/multi-pack-index).
+
+A single MIDX file indexes the objects of many packs, so one lookup answers
+which pack holds an object and at which offset.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from collections import namedtuple
+
+from idx_file_reader import FANOUT_LEN, HASH_LEN, OFFSET_64_LEN, HashTable, MappedIndex, UInt32Table
+
+MIDX_SIGNATURE = b"MIDX"
+MIDX_VERSION = 1
+OID_VERSION_SHA1 = 1
+
+# signature, version, OID version, number of chunks, number of base MIDXs,
+# number of packs
+MIDX_HEADER = struct.Struct(">4sBBBBI")
+# chunk id, chunk offset
+CHUNK_LOOKUP_ENTRY = struct.Struct(">4sQ")
+# pack-int-id, offset
+OBJECT_OFFSET = struct.Struct(">II")
+_UINT64 = struct.Struct(">Q")
+
+REQUIRED_CHUNKS = (b"PNAM", b"OIDF", b"OIDL", b"OOFF")
+
+MidxEntry = namedtuple("MidxEntry", "index, pack, offset")
+
+
+class MultiPackIndex(MappedIndex):
+    """Lazily decoded, memory-mapped multi-pack-index.
+
+    Only the header, the chunk table and the pack names are read when
+    opening; objects are decoded on access like in `PackIndex`.
+    """
+
+    def __init__(self, data, path: str | os.PathLike | None = None) -> None:
+        super().__init__(data, path)
+        view = self._view
+
+        if len(view) < MIDX_HEADER.size:
+            raise ValueError("Truncated multi-pack-index")
+        (
+            signature,
+            version,
+            oid_version,
+            chunk_count,
+            base_midx_count,
+            pack_count,
+        ) = MIDX_HEADER.unpack_from(view)
+
+        if signature != MIDX_SIGNATURE:
+            raise ValueError("Not a multi-pack-index")
+        if version != MIDX_VERSION:
+            raise ValueError(f"Unsupported multi-pack-index version: {version}")
+        if oid_version != OID_VERSION_SHA1:
+            raise ValueError(f"Unsupported object id version: {oid_version}")
+        if base_midx_count:
+            raise ValueError("Incremental multi-pack-index chains are not supported")
+
+        # The chunk table has a terminating entry, whose offset is the end of
+        # the last chunk.
+        chunk_table = [
+            CHUNK_LOOKUP_ENTRY.unpack_from(view, MIDX_HEADER.size + i * CHUNK_LOOKUP_ENTRY.size)
+            for i in range(chunk_count + 1)
+        ]
+        self.chunks = {
+            chunk_id: (start, end)
+            for (chunk_id, start), (_, end) in zip(chunk_table, chunk_table[1:])
+        }
+        missing = [chunk_id.decode() for chunk_id in REQUIRED_CHUNKS if chunk_id not in self.chunks]
+        if missing:
+            raise ValueError(f"multi-pack-index is missing chunks: {', '.join(missing)}")
+
+        # Names are NUL-terminated, the chunk may be padded with more NULs.
+        names = bytes(self._chunk(b"PNAM")).split(b"\0")
+        self.pack_names = [name.decode() for name in names if name]
+        if len(self.pack_names) != pack_count:
+            raise ValueError("Pack name count doesn't match the multi-pack-index header")
+
+        self.fanout = UInt32Table(self._chunk(b"OIDF"))
+        if len(self.fanout) != FANOUT_LEN // 4:
+            raise ValueError("Malformed OIDF chunk")
+        self.hashes = HashTable(self._chunk(b"OIDL"))
+        self._object_offsets = self._chunk(b"OOFF")
+
+        # Without the LOFF chunk all offsets fit in 32 bits and the MSB isn't
+        # a flag.
+        self._large_offsets = self._chunk(b"LOFF") if b"LOFF" in self.chunks else None
+
+        self.checksum = bytes(view[len(view) - HASH_LEN :])
+
+    def _chunk(self, chunk_id: bytes) -> memoryview:
+        """Buffer slice of the chunk, released on `close()`."""
+        start, end = self.chunks[chunk_id]
+        return self._table(self._view[start:end])
+
+    def pack_id(self, idx: int) -> int:
+        """Position in `pack_names` of the pack holding the `idx`-th object."""
+        idx = self._check_index(idx)
+        return OBJECT_OFFSET.unpack_from(self._object_offsets, idx * OBJECT_OFFSET.size)[0]
+
+    def pack(self, idx: int) -> str:
+        """Name of the .idx file of the pack holding the `idx`-th object."""
+        return self.pack_names[self.pack_id(idx)]
+
+    def offset(self, idx: int) -> int:
+        """Offset of the `idx`-th object within its pack."""
+        idx = self._check_index(idx)
+        _, offset = OBJECT_OFFSET.unpack_from(self._object_offsets, idx * OBJECT_OFFSET.size)
+
+        if self._large_offsets is not None and offset & (1 << 31):
+            large_offset_idx = offset & ~(1 << 31)
+            offset = _UINT64.unpack_from(self._large_offsets, large_offset_idx * OFFSET_64_LEN)[0]
+
+        return offset
+
+    def entry(self, idx: int) -> MidxEntry:
+        return MidxEntry(idx, self.pack(idx), self.offset(idx))
@@ -0,0 +1,184 @@
+"""
+Object lookups across all packs of a repository.
+
+Opens every pack index under .git/objects/pack (or the multi-pack-index
+covering them) and answers which pack holds an object and at which offset.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from idx_file_reader import AmbiguousPrefixError, MappedIndex, PackIndex, binary_sha
+from midx_file_reader import MultiPackIndex
+from pack_filter import BloomFilter, pack_filter
+
+MIDX_NAME = "multi-pack-index"
+
+ObjectLocation = namedtuple("ObjectLocation", "pack_path, offset")
+
+
+class ObjectStore:
+    """All packed objects of a repository.
+
+    Indexes are searched most-recently-hit first, like git does, since
+    objects looked up together tend to live in the same pack.
+
+    With `use_filters`, each index gets a Bloom filter (see `pack_filter`), so
+    that an index not holding an object is mostly skipped without a search.
+    """
+
+    def __init__(
+        self,
+        objects_dir: str | os.PathLike,
+        max_workers: int | None = None,
+        use_filters: bool = False,
+    ) -> None:
+        self.pack_dir = Path(objects_dir) / "pack"
+        idx_paths = sorted(self.pack_dir.glob("*.idx"))
+
+        indexes: list[MappedIndex] = []
+        midx_path = self.pack_dir / MIDX_NAME
+        if midx_path.exists():
+            midx = MultiPackIndex.open(midx_path)
+            indexes.append(midx)
+            covered = set(midx.pack_names)
+            idx_paths = [path for path in idx_paths if path.name not in covered]
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            indexes.extend(pool.map(PackIndex.open, idx_paths))
+            filters = pool.map(pack_filter, indexes) if use_filters else ()
+            self._filters: dict[MappedIndex, BloomFilter] = dict(zip(indexes, filters))
+
+        # Most recently hit first.
+        self.indexes = indexes
+
+    @classmethod
+    def from_repo(cls, repo: str | os.PathLike, **kwargs) -> ObjectStore:
+        """Open the object store of a repository, either bare or with a worktree."""
+        repo = Path(repo)
+        git_dir = repo / ".git" if (repo / ".git").is_dir() else repo
+        return cls(git_dir / "objects", **kwargs)
+
+    def close(self) -> None:
+        for index in self.indexes:
+            index.close()
+
+    def __enter__(self) -> ObjectStore:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.pack_dir} ({len(self.indexes)} indexes)>"
+
+    def _location(self, index: MappedIndex, idx: int) -> ObjectLocation:
+        if isinstance(index, MultiPackIndex):
+            pack_path = self.pack_dir / Path(index.pack(idx)).with_suffix(".pack")
+        else:
+            pack_path = index.pack_path
+        return ObjectLocation(pack_path, index.offset(idx))
+
+    def _may_contain(self, index: MappedIndex, sha: bytes) -> bool:
+        bloom = self._filters.get(index)
+        return bloom is None or sha in bloom
+
+    def _mark_hit(self, position: int) -> None:
+        if position:
+            self.indexes.insert(0, self.indexes.pop(position))
+
+    def lookup(self, sha: bytes | str) -> ObjectLocation:
+        """Find the pack holding an object. Raises `KeyError` if there's none."""
+        sha = binary_sha(sha)
+        for position, index in enumerate(self.indexes):
+            if not self._may_contain(index, sha):
+                continue
+            idx = index.find(sha)
+            if idx is not None:
+                self._mark_hit(position)
+                return self._location(index, idx)
+        raise KeyError(sha)
+
+    def __contains__(self, sha: bytes | str) -> bool:
+        sha = binary_sha(sha)
+        return any(
+            self._may_contain(index, sha) and index.find(sha) is not None
+            for index in self.indexes
+        )
+
+    def lookup_many(self, shas) -> dict[bytes, ObjectLocation]:
+        """Look up many objects, searching each index once for all of them.
+
+        Returns a dict keyed by binary SHA; objects not found are left out.
+        """
+        remaining = set(map(binary_sha, shas))
+        found = {}
+        hits = []
+        for position, index in enumerate(self.indexes):
+            if not remaining:
+                break
+            candidates = [sha for sha in remaining if self._may_contain(index, sha)]
+            entries = index.lookup_many(candidates)
+            if entries:
+                hits.append((len(entries), position))
+            for sha, entry in entries.items():
+                found[sha] = self._location(index, entry.index)
+            remaining.difference_update(entries)
+
+        # The index that answered the most goes first.
+        if hits:
+            self._mark_hit(max(hits)[1])
+        return found
+
+    def resolve_prefix(self, hex_prefix: str) -> bytes:
+        """Expand an abbreviated hex SHA, looking at all packs.
+
+        Raises `KeyError` if no object matches and `AmbiguousPrefixError` if
+        more than one does. Objects present in several packs count once.
+        """
+        candidates = set()
+        for index in self.indexes:
+            candidates.update(index.prefix_matches(hex_prefix))
+
+        if not candidates:
+            raise KeyError(hex_prefix)
+        if len(candidates) > 1:
+            raise AmbiguousPrefixError(hex_prefix, sorted(candidates))
+        return candidates.pop()
+
+
+USAGE = f"Usage: {sys.argv[0]} <repo> <sha>..."
+MINARGS = 3
+
+
+def main(args: list[str]):
+    repo, *prefixes = args
+    with ObjectStore.from_repo(repo) as store:
+        for prefix in prefixes:
+            try:
+                sha = store.resolve_prefix(prefix)
+            except AmbiguousPrefixError as e:
+                print(e)
+                continue
+            except KeyError:
+                print(f"{prefix}: not found")
+                continue
+            except ValueError:
+                print(f"{prefix}: not a hex SHA")
+                continue
+            pack_path, offset = store.lookup(sha)
+            print(f"{sha.hex()} {pack_path.name} {offset}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < MINARGS:
+        print(USAGE)
+        sys.exit(1)
+
+    sys.argv.pop(0)
+    main(sys.argv)
@@ -0,0 +1,122 @@
+"""
+Bloom filters over the SHA tables of pack indexes, for cheap negative lookups.
+
+A filter is built from an index the first time it is needed and saved next
+to it as a .bloom file. The file records the mtime and the checksum of the
+index it was built from and is rebuilt when either of them changes.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import struct
+from pathlib import Path
+
+from idx_file_reader import MappedIndex
+
+BLOOM_SIGNATURE = b"BLMF"
+BLOOM_VERSION = 1
+# signature, version, number of probes, number of bits, idx mtime in ns,
+# idx checksum
+BLOOM_HEADER = struct.Struct(">4sIIQQ20s")
+BLOOM_SUFFIX = ".bloom"
+
+BITS_PER_OBJECT = 10
+_UINT64 = struct.Struct(">Q")
+
+
+class BloomFilter:
+    """Bloom filter over binary SHA-1s.
+
+    SHAs are already uniformly distributed, so the probe positions are
+    derived from two 64-bit slices of the SHA itself instead of hashing it
+    again.
+    """
+
+    def __init__(self, bits: bytearray, bit_count: int, probes: int) -> None:
+        self.bits = bits
+        self.bit_count = bit_count
+        self.probes = probes
+
+    @classmethod
+    def for_capacity(cls, count: int, bits_per_object: int = BITS_PER_OBJECT) -> BloomFilter:
+        bit_count = max(64, count * bits_per_object)
+        # Optimal number of probes for the given bits per object.
+        probes = max(1, round(bits_per_object * math.log(2)))
+        return cls(bytearray((bit_count + 7) // 8), bit_count, probes)
+
+    def _positions(self, sha: bytes):
+        # The leading bytes are what the fanout table already narrows on.
+        h1 = _UINT64.unpack_from(sha, 4)[0]
+        h2 = _UINT64.unpack_from(sha, 12)[0] | 1
+        for i in range(self.probes):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, sha: bytes) -> None:
+        bits = self.bits
+        for pos in self._positions(sha):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, sha: bytes) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(sha))
+
+
+def _idx_stamp(index: MappedIndex) -> tuple[int, bytes]:
+    return os.stat(index.path).st_mtime_ns, index.checksum
+
+
+def filter_path(index: MappedIndex) -> Path:
+    return index.path.with_suffix(BLOOM_SUFFIX)
+
+
+def build_filter(index: MappedIndex, bits_per_object: int = BITS_PER_OBJECT) -> BloomFilter:
+    """Build a filter from the SHA table of the index."""
+    bloom = BloomFilter.for_capacity(len(index), bits_per_object)
+    for sha in index.hashes:
+        bloom.add(sha)
+    return bloom
+
+
+def save_filter(index: MappedIndex, bloom: BloomFilter) -> None:
+    mtime_ns, checksum = _idx_stamp(index)
+    header = BLOOM_HEADER.pack(
+        BLOOM_SIGNATURE, BLOOM_VERSION, bloom.probes, bloom.bit_count, mtime_ns, checksum
+    )
+    # Write aside and rename, so that concurrent readers never see a partial file.
+    path = filter_path(index)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(header + bloom.bits)
+    os.replace(tmp_path, path)
+
+
+def load_filter(index: MappedIndex) -> BloomFilter | None:
+    """Read the saved filter of an index, or `None` if it's missing or stale."""
+    try:
+        data = filter_path(index).read_bytes()
+        signature, version, probes, bit_count, mtime_ns, checksum = BLOOM_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+
+    if signature != BLOOM_SIGNATURE or version != BLOOM_VERSION:
+        return None
+    if (mtime_ns, checksum) != _idx_stamp(index):
+        return None
+    bits = bytearray(data[BLOOM_HEADER.size :])
+    if len(bits) != (bit_count + 7) // 8:
+        return None
+    return BloomFilter(bits, bit_count, probes)
+
+
+def pack_filter(index: MappedIndex, persist: bool = True) -> BloomFilter:
+    """Saved filter of the index, built (and saved) first if needed."""
+    bloom = load_filter(index)
+    if bloom is None:
+        bloom = build_filter(index)
+        if persist:
+            try:
+                save_filter(index, bloom)
+            except OSError:
+                pass  # Read-only pack directory, use the filter in memory only.
+    return bloom
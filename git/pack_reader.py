@@ -0,0 +1,347 @@
+"""
+Reads objects out of git .pack files, at offsets found in the pack indexes.
+
+Object data is inflated in chunks. Deltified objects are rebuilt from their
+bases, which are kept in a size-bounded LRU cache so that objects sharing a
+base don't inflate it over and over.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from typing import Callable
+
+from idx_file_reader import HASH_LEN, PackIndex
+
+PACK_SIGNATURE = b"PACK"
+PACK_VERSIONS = (2, 3)
+# signature, version, number of objects
+PACK_HEADER = struct.Struct(">4sII")
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {
+    OBJ_COMMIT: "commit",
+    OBJ_TREE: "tree",
+    OBJ_BLOB: "blob",
+    OBJ_TAG: "tag",
+}
+DELTA_TYPES = (OBJ_OFS_DELTA, OBJ_REF_DELTA)
+
+CHUNK_SIZE = 64 * 1024
+# Same as git's core.deltaBaseCacheLimit default.
+DEFAULT_CACHE_SIZE = 96 * 1024 * 1024
+
+# `base` is the base object offset for OFS_DELTA, its binary SHA for
+# REF_DELTA and None otherwise. `data_offset` is where the zlib stream starts.
+ObjectHeader = namedtuple("ObjectHeader", "type, size, data_offset, base")
+
+
+class DeltaBaseCache:
+    """LRU cache of delta base objects, bounded by the total size of their data."""
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self._entries: OrderedDict[int, tuple[int, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, offset: int) -> tuple[int, bytes] | None:
+        entry = self._entries.get(offset)
+        if entry is not None:
+            self._entries.move_to_end(offset)
+        return entry
+
+    def put(self, offset: int, obj_type: int, data: bytes) -> None:
+        if len(data) > self.max_size or offset in self._entries:
+            return
+        self._entries[offset] = (obj_type, data)
+        self.size += len(data)
+        while self.size > self.max_size:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def _read_varint(data, pos: int) -> tuple[int, int]:
+    """Little-endian base-128 size, as used in delta headers."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuild an object from its base and a git delta."""
+    base_size, pos = _read_varint(delta, 0)
+    if base_size != len(base):
+        raise ValueError(f"Delta base size mismatch: expected {base_size}, got {len(base)}")
+    result_size, pos = _read_varint(delta, pos)
+
+    result = bytearray()
+    delta_len = len(delta)
+    while pos < delta_len:
+        cmd = delta[pos]
+        pos += 1
+        if cmd & 0x80:
+            # Copy from base. Bits 0-3 select the offset bytes, 4-6 the size bytes.
+            copy_offset = copy_size = 0
+            for bit in range(4):
+                if cmd & (1 << bit):
+                    copy_offset |= delta[pos] << (8 * bit)
+                    pos += 1
+            for bit in range(3):
+                if cmd & (1 << (4 + bit)):
+                    copy_size |= delta[pos] << (8 * bit)
+                    pos += 1
+            if copy_size == 0:
+                copy_size = 0x10000
+            result += base[copy_offset : copy_offset + copy_size]
+        elif cmd:
+            # Insert the next `cmd` bytes of the delta.
+            result += delta[pos : pos + cmd]
+            pos += cmd
+        else:
+            raise ValueError("Invalid delta opcode 0")
+
+    if len(result) != result_size:
+        raise ValueError(f"Delta result size mismatch: expected {result_size}, got {len(result)}")
+    return bytes(result)
+
+
+class PackFile:
+    """Memory-mapped .pack file.
+
+    REF_DELTA bases are located with `resolve_ref`, a callable mapping a
+    binary SHA to an offset in this pack. By default the .idx next to the
+    pack is used.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        resolve_ref: Callable[[bytes], int] | None = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            signature, self.version, self.object_count = PACK_HEADER.unpack_from(self._map)
+        except struct.error:
+            self._map.close()
+            raise ValueError(f"Truncated pack file: {self.path}") from None
+        if signature != PACK_SIGNATURE or self.version not in PACK_VERSIONS:
+            self._map.close()
+            raise ValueError(f"Not a version 2 or 3 pack file: {self.path}")
+
+        self._resolve_ref = resolve_ref
+        self._index: PackIndex | None = None
+        self.cache = DeltaBaseCache(cache_size)
+
+    def close(self) -> None:
+        if self._index is not None:
+            self._index.close()
+        self._map.close()
+
+    def __enter__(self) -> PackFile:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    @property
+    def checksum(self) -> bytes:
+        """SHA-1 of the pack contents, as stored in its trailer."""
+        return self._map[-HASH_LEN:]
+
+    def resolve_ref(self, sha: bytes) -> int:
+        if self._resolve_ref is None:
+            self._index = PackIndex.open(self.path.with_suffix(".idx"))
+            self._resolve_ref = lambda sha: self._index.lookup(sha).offset
+        return self._resolve_ref(sha)
+
+    def read_header(self, offset: int) -> ObjectHeader:
+        """Decode the type and size header of the object at `offset`."""
+        data = self._map
+        pos = offset
+
+        # Type in bits 4-6, size in the low 4 bits followed by 7 bits per byte.
+        byte = data[pos]
+        pos += 1
+        obj_type = (byte >> 4) & 0x7
+        size = byte & 0x0F
+        shift = 4
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+
+        base = None
+        if obj_type == OBJ_OFS_DELTA:
+            # Big-endian base-128 negative offset, with an extra +1 per
+            # continuation byte so that encodings are unique.
+            byte = data[pos]
+            pos += 1
+            distance = byte & 0x7F
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7F)
+            base = offset - distance
+        elif obj_type == OBJ_REF_DELTA:
+            base = data[pos : pos + HASH_LEN]
+            pos += HASH_LEN
+        elif obj_type not in TYPE_NAMES:
+            raise ValueError(f"Invalid object type {obj_type} at offset {offset}")
+
+        return ObjectHeader(obj_type, size, pos, base)
+
+    def iter_inflate(self, data_offset: int, chunk_size: int = CHUNK_SIZE):
+        """Inflate the zlib stream starting at `data_offset`, chunk by chunk.
+
+        Neither the compressed input nor the output chunks exceed `chunk_size`.
+        The generator returns the offset right past the end of the stream.
+        """
+        decompressor = zlib.decompressobj()
+        pos = data_offset
+        pending = b""
+        while not decompressor.eof:
+            if not pending:
+                pending = self._map[pos : pos + chunk_size]
+                if not pending:
+                    raise ValueError(f"Truncated zlib stream at offset {data_offset}")
+                pos += len(pending)
+            chunk = decompressor.decompress(pending, chunk_size)
+            pending = decompressor.unconsumed_tail
+            if chunk:
+                yield chunk
+        return pos - len(pending) - len(decompressor.unused_data)
+
+    def object_end(self, header: ObjectHeader) -> int:
+        """Offset right past the compressed data of an object."""
+        chunks = self.iter_inflate(header.data_offset)
+        while True:
+            try:
+                next(chunks)
+            except StopIteration as stop:
+                return stop.value
+
+    def iter_objects(self):
+        """Yield the offset, header and end offset of each object, in pack order.
+
+        Every object has to be inflated to find where the next one starts.
+        """
+        offset = PACK_HEADER.size
+        for _ in range(self.object_count):
+            header = self.read_header(offset)
+            end = self.object_end(header)
+            yield offset, header, end
+            offset = end
+
+    def crc32(self, offset: int, end: int) -> int:
+        """CRC-32 of the raw packed bytes between the two offsets."""
+        with memoryview(self._map) as view:
+            return zlib.crc32(view[offset:end])
+
+    def _inflate(self, header: ObjectHeader) -> bytes:
+        data = b"".join(self.iter_inflate(header.data_offset))
+        if len(data) != header.size:
+            raise ValueError(
+                f"Object size mismatch at offset {header.data_offset}: "
+                f"expected {header.size}, got {len(data)}"
+            )
+        return data
+
+    def _base_offset(self, offset: int, header: ObjectHeader) -> int:
+        if header.type == OBJ_OFS_DELTA:
+            return header.base
+        return self.resolve_ref(header.base)
+
+    def read_object(self, offset: int) -> tuple[str, bytes]:
+        """Read the object at `offset`, resolving its delta chain if any.
+
+        Returns the type name and the full object data.
+        """
+        # Walk down the chain until an undeltified or a cached base is found.
+        chain = []
+        while True:
+            cached = self.cache.get(offset)
+            if cached is not None:
+                obj_type, data = cached
+                break
+            header = self.read_header(offset)
+            if header.type not in DELTA_TYPES:
+                obj_type, data = header.type, self._inflate(header)
+                break
+            chain.append((offset, header))
+            offset = self._base_offset(offset, header)
+
+        # Then apply the deltas back up, remembering every base on the way.
+        for delta_offset, delta_header in reversed(chain):
+            self.cache.put(offset, obj_type, data)
+            data = apply_delta(data, self._inflate(delta_header))
+            offset = delta_offset
+
+        return TYPE_NAMES[obj_type], data
+
+    def stream_object(self, offset: int, chunk_size: int = CHUNK_SIZE):
+        """Return the type name, size and a chunk iterator of an object's data.
+
+        Undeltified objects are inflated lazily, chunk by chunk. Deltas need the
+        whole base to be applied, so these are read in full first.
+        """
+        header = self.read_header(offset)
+        if header.type in DELTA_TYPES:
+            type_name, data = self.read_object(offset)
+            return type_name, len(data), iter((data,))
+        return TYPE_NAMES[header.type], header.size, self.iter_inflate(header.data_offset, chunk_size)
+
+
+USAGE = f"Usage: {sys.argv[0]} <repo> <sha>"
+MAXARGS = 3
+MINARGS = 3
+
+
+def main(args: list[str]):
+    from object_store import ObjectStore
+
+    repo, prefix = args
+    with ObjectStore.from_repo(repo) as store:
+        pack_path, offset = store.lookup(store.resolve_prefix(prefix))
+
+    with PackFile(pack_path) as pack:
+        type_name, size, chunks = pack.stream_object(offset)
+        print(f"{type_name} {size}", file=sys.stderr)
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+
+
+if __name__ == "__main__":
+    if not (MINARGS <= len(sys.argv) <= MAXARGS):
+        print(USAGE)
+        sys.exit(1)
+
+    sys.argv.pop(0)
+    main(sys.argv)
@@ -0,0 +1,165 @@
+"""
+Verifies packs against their indexes: the CRC-32 of every packed object and
+the SHA-1 trailers of both the .pack and the .idx file.
+
+The pack is split into batches of whole objects, using the offsets from the
+index, and the batches are checked on a process pool. Only a bounded number
+of batches is in flight at a time, so memory use doesn't grow with the pack.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from idx_file_reader import HASH_LEN, PackIndex
+
+BATCH_SIZE = 64 * 1024 * 1024
+HASH_WINDOW = 16 * 1024 * 1024
+
+CrcMismatch = namedtuple("CrcMismatch", "sha, offset, expected, actual")
+VerifyResult = namedtuple(
+    "VerifyResult", "crc_mismatches, pack_checksum_ok, idx_checksum_ok, idx_matches_pack"
+)
+
+# Per-process state of the pool workers, see `_init_worker`.
+_worker_index: PackIndex | None = None
+_worker_pack: memoryview | None = None
+
+
+def _init_worker(idx_path: Path, pack_path: Path) -> None:
+    global _worker_index, _worker_pack
+    _worker_index = PackIndex.open(idx_path)
+    with open(pack_path, "rb") as f:
+        _worker_pack = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _check_batch(positions: array, offsets: array, end: int) -> list[CrcMismatch]:
+    """Check the CRC-32 of consecutive objects; the last one ends at `end`."""
+    mismatches = []
+    for i, idx in enumerate(positions):
+        start = offsets[i]
+        stop = offsets[i + 1] if i + 1 < len(offsets) else end
+        actual = zlib.crc32(_worker_pack[start:stop])
+        expected = _worker_index.crc32(idx)
+        if actual != expected:
+            mismatches.append(CrcMismatch(_worker_index.sha(idx), start, expected, actual))
+    return mismatches
+
+
+def file_checksum(path: Path) -> tuple[bytes, bytes]:
+    """SHA-1 of a git file's contents and the checksum stored in its trailer."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                body_len = len(view) - HASH_LEN
+                sha = hashlib.sha1()
+                for start in range(0, body_len, HASH_WINDOW):
+                    sha.update(view[start : min(start + HASH_WINDOW, body_len)])
+                stored = bytes(view[body_len:])
+    return sha.digest(), stored
+
+
+def _batches(index: PackIndex, batch_size: int):
+    """Split the pack into runs of whole objects of about `batch_size` bytes."""
+    positions = array("I")
+    offsets = array("Q")
+    batch_bytes = 0
+    for idx, offset, size in index.iter_pack_order():
+        positions.append(idx)
+        offsets.append(offset)
+        batch_bytes += size
+        if batch_bytes >= batch_size:
+            yield positions, offsets, offset + size
+            positions = array("I")
+            offsets = array("Q")
+            batch_bytes = 0
+    if positions:
+        yield positions, offsets, index.pack_size - HASH_LEN
+
+
+def verify_pack(
+    idx_path: str | os.PathLike,
+    max_workers: int | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> VerifyResult:
+    """Check a pack and its index, using all cores by default."""
+    idx_path = Path(idx_path)
+    pack_path = idx_path.with_suffix(".pack")
+    if not pack_path.exists():
+        raise FileNotFoundError(f"No pack file for {idx_path}")
+    max_workers = max_workers or os.cpu_count() or 1
+
+    with PackIndex.open(idx_path) as index, ProcessPoolExecutor(
+        max_workers, initializer=_init_worker, initargs=(idx_path, pack_path)
+    ) as pool:
+        # Hashing a whole file can't be split, so both run alongside the CRCs.
+        pack_checksum = pool.submit(file_checksum, pack_path)
+        idx_checksum = pool.submit(file_checksum, idx_path)
+
+        mismatches = []
+        # Version 1 indexes have no CRCs to check.
+        if index.version > 1:
+            pending = set()
+            for batch in _batches(index, batch_size):
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        mismatches.extend(future.result())
+                pending.add(pool.submit(_check_batch, *batch))
+            for future in pending:
+                mismatches.extend(future.result())
+
+        pack_actual, pack_stored = pack_checksum.result()
+        idx_actual, idx_stored = idx_checksum.result()
+
+        return VerifyResult(
+            crc_mismatches=sorted(mismatches, key=lambda m: m.offset),
+            pack_checksum_ok=pack_actual == pack_stored,
+            idx_checksum_ok=idx_actual == idx_stored,
+            idx_matches_pack=index.pack_checksum == pack_stored,
+        )
+
+
+USAGE = f"Usage: {sys.argv[0]} <idx_file>..."
+MINARGS = 2
+
+
+def main(args: list[str]) -> bool:
+    all_ok = True
+    for idx_path in args:
+        result = verify_pack(idx_path)
+        ok = (
+            not result.crc_mismatches
+            and result.pack_checksum_ok
+            and result.idx_checksum_ok
+            and result.idx_matches_pack
+        )
+        all_ok = all_ok and ok
+
+        print(f"{idx_path}: {'ok' if ok else 'FAILED'}")
+        for sha, offset, expected, actual in result.crc_mismatches:
+            print(f"  {sha.hex()} at offset {offset}: CRC-32 {actual:08x}, expected {expected:08x}")
+        if not result.pack_checksum_ok:
+            print("  .pack trailer checksum mismatch")
+        if not result.idx_checksum_ok:
+            print("  .idx trailer checksum mismatch")
+        if not result.idx_matches_pack:
+            print("  .idx was written for a different .pack")
+    return all_ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < MINARGS:
+        print(USAGE)
+        sys.exit(1)
+
+    sys.argv.pop(0)
+    sys.exit(0 if main(sys.argv) else 1)
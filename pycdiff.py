@@ -1,96 +1,1261 @@
 #!/usr/bin/env python
+from __future__ import annotations
+
 from pathlib import Path
+from array import array
 from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import difflib
+import importlib.util
+import os
 import time
 import sys
 import binascii
+import bisect
+import csv
+import json
+import hashlib
+import itertools
 import marshal
 import dis
+import re
 import struct
+import types
 
 
-PycData = namedtuple('PycData', ['magic', 'flags', 'timestamp', 'size', 'code', 'filename'])
+PYC_HEADER_LEN = 16
+CACHE_MAX_SIZE = 256 * 1024 * 1024
 
+# PEP 552 flags
+FLAG_HASH_BASED = 0b01
+FLAG_CHECK_SOURCE = 0b10
 
-def pyc_info(path: Path) -> PycData:
-    data = path.read_bytes()
-    magic = data[:4]
-    flags = data[4:8]
-    assert flags == b'\x00\x00\x00\x00', "Unsupported flags in .pyc file"
-    timestamp = data[8:12]
-    size = data[12:16]
-    code = marshal.loads(data[16:])
 
-    return PycData(
-        magic=binascii.hexlify(magic).decode('utf-8'),
-        flags=flags,
-        timestamp=time.asctime(time.localtime(struct.unpack('I', timestamp)[0])),
-        size=struct.unpack('I', size),
-        code=code,
-        filename=path.name,
-    )
+class PycData:
+    """Header of a .pyc file, with the code object unmarshalled on first use.
+
+    Timestamp-based pycs record the mtime and size of their source,
+    hash-based ones (PEP 552) a SipHash of the source contents instead.
+    """
+
+    __slots__ = ('magic', 'flags', 'mtime', 'source_size', 'source_hash', 'filename', '_path', '_body', '_code')
+
+    def __init__(self, header: bytes, filename: str, path: Path = None, body: bytes = None):
+        if len(header) < PYC_HEADER_LEN:
+            raise ValueError(f'{filename}: truncated .pyc header')
+        self.magic = binascii.hexlify(header[:4]).decode('utf-8')
+        self.flags = int.from_bytes(header[4:8], 'little')
+        if self.flags & ~(FLAG_HASH_BASED | FLAG_CHECK_SOURCE):
+            raise ValueError(f'{filename}: unsupported flags {self.flags:#x} in .pyc file')
+
+        if self.hash_based:
+            self.mtime = self.source_size = None
+            self.source_hash = header[8:16]
+        else:
+            self.mtime, self.source_size = struct.unpack('<II', header[8:16])
+            self.source_hash = None
+
+        self.filename = filename
+        self._path = path
+        self._body = body
+        self._code = None
+
+    @property
+    def hash_based(self) -> bool:
+        return bool(self.flags & FLAG_HASH_BASED)
+
+    @property
+    def check_source(self) -> bool:
+        return bool(self.flags & FLAG_CHECK_SOURCE)
+
+    @property
+    def kind(self) -> str:
+        if not self.hash_based:
+            return 'timestamp'
+        return 'checked hash' if self.check_source else 'unchecked hash'
+
+    @property
+    def timestamp(self):
+        if self.mtime is None:
+            return None
+        return time.asctime(time.localtime(self.mtime))
+
+    @property
+    def body(self) -> bytes:
+        """The marshalled code object, following the header."""
+        if self._body is None:
+            self._body = self._path.read_bytes()[PYC_HEADER_LEN:]
+        return self._body
+
+    @property
+    def code(self) -> types.CodeType:
+        if self._code is None:
+            self._code = marshal.loads(self.body)
+        return self._code
+
+    def header_fields(self) -> list:
+        """(label, value, unit) of every header field, for display."""
+        fields = [('Magic', self.magic, ''), ('Flags', self.kind, '')]
+        if self.hash_based:
+            fields.append(('Source hash', self.source_hash.hex(), ''))
+        else:
+            fields.append(('Timestamp', self.timestamp, ''))
+            fields.append(('Size', self.source_size, ' bytes'))
+        return fields
+
+
+def pyc_info(path: Path, header_only: bool = False) -> PycData:
+    """Read a .pyc file. With `header_only`, only its first 16 bytes are read."""
+    if header_only:
+        with open(path, 'rb') as f:
+            return PycData(f.read(PYC_HEADER_LEN), path.name, path=path)
+    return pyc_from_bytes(path.read_bytes(), path.name)
+
+
+def pyc_from_bytes(data: bytes, filename: str) -> PycData:
+    return PycData(data[:PYC_HEADER_LEN], filename, body=data[PYC_HEADER_LEN:])
 
 
 def view_pyc(pyc: PycData):
-    print(f'Magic: {pyc.magic}')
-    print(f'Timestamp: {pyc.timestamp}')
-    print(f'Size: {pyc.size[0]} bytes')
+    for label, value, unit in pyc.header_fields():
+        print(f'{label}: {value}{unit}')
     print('Code Object:')
     dis.dis(pyc.code)
 
 
+def view_headers(paths: list):
+    for path in paths:
+        try:
+            pyc = pyc_info(path, header_only=True)
+        except (ValueError, OSError) as e:
+            print(f'{path}: {ANSII_RED}{e}{ANSII_RESET}')
+            continue
+        fields = ' '.join(f'{value}{unit}' for _, value, unit in pyc.header_fields())
+        print(f'{path}: {fields}')
+
+
 ANSII_RED = '\033[91m'
 ANSII_RESET = '\033[0m'
 
-def diff_pyc(left: PycData, right: PycData):
-    if left.magic != right.magic:
-        print(f'{ANSII_RED}Magic: {left.magic} <> {right.magic}{ANSII_RESET}')
-    else:
-        print(f"Magic: {left.magic} (identical)")
+# Reprs of nested code objects contain a memory address, the file name and
+# the line number. These differ all the time, and the nested code objects are
+# compared on their own anyway.
+NESTED_CODE_RE = re.compile(r'<code object (\S+) at 0x[0-9a-f]+, file ".*", line \d+>')
 
-    if left.flags != right.flags:
-        print(f'{ANSII_RED}Flags: {left.flags} <> {right.flags}{ANSII_RESET}')
-    else:
-        print(f"Flags: {left.flags} (identical)")
+# Attributes that change the behaviour of a code object without necessarily
+# showing in its disassembly. The line table (and co_firstlineno) is left out
+# on purpose: line numbers shift with every unrelated edit above the code.
+# So is co_filename, which differs between trees built in different places.
+CODE_ATTRS = (
+    'co_argcount',
+    'co_posonlyargcount',
+    'co_kwonlyargcount',
+    'co_flags',
+    'co_varnames',
+    'co_cellvars',
+    'co_freevars',
+    'co_exceptiontable',
+)
+# Attributes left out of the digests. Code differing only in these behaves
+# the same, apart from tracebacks and the like.
+IGNORED_ATTRS = (
+    'co_filename',
+    'co_name',
+    'co_qualname',
+    'co_firstlineno',
+    'co_linetable',
+    'co_stacksize',
+)
 
-    if left.timestamp != right.timestamp:
-        print(f'{ANSII_RED}Timestamp: {left.timestamp} <> {right.timestamp}{ANSII_RESET}')
-    else:
-        print(f"Timestamp: {left.timestamp} (identical)")
 
-    if left.size != right.size:
-        print(f'{ANSII_RED}Size: {left.size[0]} <> {right.size[0]} bytes{ANSII_RESET}')
-    else:
-        print(f"Size: {left.size[0]} bytes (identical)")
-
-    if left.code != right.code:
-        left_dis = dis.Bytecode(left.code).dis()
-        right_dis = dis.Bytecode(right.code).dis()
-
-        diff = difflib.unified_diff(
-            left_dis.splitlines(),
-            right_dis.splitlines(),
-            fromfile=left.filename,
-            tofile=right.filename,
-            lineterm=''
-        )
+class CodeNode:
+    """A code object together with the code objects nested in its constants.
+
+    `digest` identifies the code object alone, `tree_digest` also everything
+    nested in it. Equal tree digests mean that a whole subtree can be skipped
+    when diffing.
+    """
+
+    __slots__ = (
+        'qualname', 'digest', 'tree_digest', 'children', 'attributes', 'constants', 'ignored',
+        'code', '_instructions',
+    )
+
+    def __init__(self, qualname, digest, tree_digest, children, attributes, constants, ignored,
+                 code=None, instructions=None):
+        self.qualname = qualname
+        self.digest = digest
+        self.tree_digest = tree_digest
+        self.children = children
+        # Values of CODE_ATTRS, in order.
+        self.attributes = attributes
+        # _const_key() of the constants that aren't code objects, in order.
+        self.constants = constants
+        # Values of IGNORED_ATTRS, in order.
+        self.ignored = ignored
+        self.code = code
+        self._instructions = instructions
+
+    def instructions(self) -> list[tuple[str, str, int]]:
+        """(opname, argrepr, offset) of the instructions of this code object only."""
+        if self._instructions is None:
+            self._instructions = [
+                (instr.opname, NESTED_CODE_RE.sub(r'<code object \1>', instr.argrepr), instr.offset)
+                for instr in dis.get_instructions(self.code)
+            ]
+        return self._instructions
+
+
+def _const_key(const, nested_digests) -> str:
+    """Deterministic representation of a constant, for hashing."""
+    if isinstance(const, types.CodeType):
+        return f'code:{nested_digests[id(const)]}'
+    if isinstance(const, tuple):
+        return '(' + ','.join(_const_key(item, nested_digests) for item in const) + ')'
+    if isinstance(const, frozenset):
+        # Iteration order of sets depends on the hash seed.
+        return '{' + ','.join(sorted(_const_key(item, nested_digests) for item in const)) + '}'
+    return f'{type(const).__name__}:{const!r}'
+
+
+def code_tree(code: types.CodeType) -> CodeNode:
+    """Build the tree of nested code objects, hashing each of them."""
+    nested_code = [const for const in code.co_consts if isinstance(const, types.CodeType)]
+    children = [code_tree(const) for const in nested_code]
+
+    attributes = tuple(getattr(code, attr, None) for attr in CODE_ATTRS)
+    ignored = tuple(getattr(code, attr, None) for attr in IGNORED_ATTRS)
+
+    # Besides co_code, co_consts and co_names, hash the signature, the flags,
+    # the variable names and the exception table too.
+    own = hashlib.sha256(code.co_code)
+    own.update('\0'.join(code.co_names).encode() + b'\1')
+    own.update(repr(attributes).encode())
+    placeholders = {id(const): '' for const in nested_code}
+    own.update(_const_key(code.co_consts, placeholders).encode())
+    constants = tuple(
+        _const_key(const, placeholders)
+        for const in code.co_consts
+        if not isinstance(const, types.CodeType)
+    )
+
+    tree = own.copy()
+    tree_digests = {id(const): child.tree_digest for const, child in zip(nested_code, children)}
+    tree.update(_const_key(code.co_consts, tree_digests).encode())
+
+    qualname = getattr(code, 'co_qualname', code.co_name)
+    return CodeNode(qualname, own.hexdigest(), tree.hexdigest(), children, attributes, constants,
+                    ignored, code)
+
+
+class CodeTreeCache:
+    """On-disk cache of code trees, addressed by the SHA-256 of the marshalled code.
+
+    Entries hold the digests and the instructions of every code object, so a
+    cached pyc is diffed without unmarshalling or disassembling anything.
+    Reading an entry bumps its mtime, and `evict()` removes the least recently
+    used entries until the cache fits in `max_size` bytes.
+    """
+
+    SIGNATURE = b'PCDC'
+    VERSION = 4
+    EVICTION_STAMP = 'evicted'
+
+    def __init__(self, directory: Path, max_size: int = CACHE_MAX_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    @classmethod
+    def default(cls) -> 'CodeTreeCache':
+        cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+        return cls(os.environ.get('PYCDIFF_CACHE_DIR') or Path(cache_home) / 'pycdiff')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.evict()
+
+    def key(self, body: bytes) -> str:
+        # Disassembly depends on the running interpreter, not just the bytes.
+        key = hashlib.sha256(importlib.util.MAGIC_NUMBER + bytes([self.VERSION]))
+        key.update(body)
+        return key.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key[2:]
+
+    def get(self, key: str) -> CodeNode | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Read-only cache, the entry just won't count as recently used.
+        if data[:4] != self.SIGNATURE:
+            return None
+        try:
+            return _node_from_tuple(marshal.loads(data[4:]))
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def put(self, key: str, node: CodeNode):
+        path = self._path(key)
+        data = self.SIGNATURE + marshal.dumps(_node_to_tuple(node))
+        # Write aside and rename, so that concurrent readers never see a partial file.
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # A cache that can't be written to only makes things slower.
+
+    def _shards_changed_since(self, shards: list, mtime_ns: int) -> bool:
+        for shard in shards:
+            try:
+                if shard.stat().st_mtime_ns > mtime_ns:
+                    return True
+            except OSError:
+                continue
+        return False
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`.
+
+        Entries are only added by `put()`, which changes the mtime of their
+        shard directory. Unless some shard changed since the last eviction,
+        this returns without looking at the entries.
+        """
+        stamp = self.directory / self.EVICTION_STAMP
+        try:
+            shards = [entry for entry in os.scandir(self.directory) if entry.is_dir()]
+        except OSError:
+            return
+        try:
+            evicted_ns = stamp.stat().st_mtime_ns
+        except OSError:
+            evicted_ns = -1
+        if not self._shards_changed_since(shards, evicted_ns):
+            return
+        # Stamped before scanning, so that entries put meanwhile are seen next time.
+        try:
+            stamp.touch()
+        except OSError:
+            pass
+
+        entries = []
+        total = 0
+        for shard in shards:
+            # Concurrent runs add, rename and evict entries all the time.
+            try:
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            except OSError:
+                continue
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def _node_to_tuple(node: CodeNode) -> tuple:
+    return (
+        node.qualname,
+        node.digest,
+        node.tree_digest,
+        node.attributes,
+        node.constants,
+        node.ignored,
+        tuple(node.instructions()),
+        tuple(_node_to_tuple(child) for child in node.children),
+    )
+
+
+def _node_from_tuple(data: tuple) -> CodeNode:
+    qualname, digest, tree_digest, attributes, constants, ignored, instructions, children = data
+    children = [_node_from_tuple(child) for child in children]
+    return CodeNode(qualname, digest, tree_digest, children, attributes, constants, ignored,
+                    instructions=instructions)
+
+
+def pyc_code_tree(pyc: PycData, cache: CodeTreeCache | None = None) -> CodeNode:
+    """Code tree of a pyc, from the cache if it's been seen before."""
+    if cache is None:
+        return code_tree(pyc.code)
+
+    key = cache.key(pyc.body)
+    node = cache.get(key)
+    if node is None:
+        node = code_tree(pyc.code)
+        cache.put(key, node)
+    return node
+
+
+def _paired_children(left: CodeNode, right: CodeNode):
+    """Pair up children by qualname, in order of appearance among equal names."""
+    def keyed(children):
+        seen = {}
+        for child in children:
+            occurrence = seen.get(child.qualname, 0)
+            seen[child.qualname] = occurrence + 1
+            yield (child.qualname, occurrence), child
+
+    right_children = dict(keyed(right.children))
+    for key, left_child in keyed(left.children):
+        yield left_child, right_children.pop(key, None)
+    for right_child in right_children.values():
+        yield None, right_child
+
+
+# Diff backends take two sequences of ints and yield difflib-style opcodes,
+# (tag, i1, i2, j1, j2), in order.
+
+def difflib_opcodes(a: list, b: list):
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+
+
+def _common_affixes(a, a_lo, a_hi, b, b_lo, b_hi) -> tuple[int, int]:
+    prefix = 0
+    while a_lo + prefix < a_hi and b_lo + prefix < b_hi and a[a_lo + prefix] == b[b_lo + prefix]:
+        prefix += 1
+    suffix = 0
+    while (a_hi - suffix > a_lo + prefix and b_hi - suffix > b_lo + prefix
+           and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]):
+        suffix += 1
+    return prefix, suffix
+
+
+def _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi):
+    """Split point of an optimal edit script, found by searching from both ends.
+
+    Returns None if the two ranges have nothing in common.
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    forward = [-1] * (2 * max_d + 2)
+    forward[v_offset + 1] = 0
+    backward = forward[:]
+    delta = n - m
+    # With an odd delta the paths meet while extending forward, else backward.
+    odd = delta % 2 != 0
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    for d in range(max_d):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
+            else:
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            forward[k1_offset] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif odd:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < len(backward) and backward[k2_offset] != -1:
+                    if x1 >= n - backward[k2_offset]:
+                        return x1, y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[k2_offset] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not odd:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < len(forward) and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, v_offset + x1 - k1_offset
+    return None
+
+
+def _myers_range(a, a_lo, a_hi, b, b_lo, b_hi):
+    # Ranges still to diff and finished opcodes, popped in output order.
+    stack = [(a_lo, a_hi, b_lo, b_hi)]
+    while stack:
+        item = stack.pop()
+        if len(item) == 5:
+            yield item
+            continue
+
+        a_lo, a_hi, b_lo, b_hi = item
+        prefix, suffix = _common_affixes(a, a_lo, a_hi, b, b_lo, b_hi)
+        if prefix:
+            yield ('equal', a_lo, a_lo + prefix, b_lo, b_lo + prefix)
+        if suffix:
+            stack.append(('equal', a_hi - suffix, a_hi, b_hi - suffix, b_hi))
+        a_lo += prefix
+        b_lo += prefix
+        a_hi -= suffix
+        b_hi -= suffix
+
+        if a_lo == a_hi and b_lo == b_hi:
+            continue
+        if a_lo == a_hi:
+            stack.append(('insert', a_lo, a_hi, b_lo, b_hi))
+            continue
+        if b_lo == b_hi:
+            stack.append(('delete', a_lo, a_hi, b_lo, b_hi))
+            continue
+
+        split = _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi)
+        if split is None:
+            stack.append(('replace', a_lo, a_hi, b_lo, b_hi))
+            continue
+        x, y = split
+        stack.append((a_lo + x, a_hi, b_lo + y, b_hi))
+        stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+
+
+def myers_opcodes(a: list, b: list):
+    """Myers' O(ND) diff, in linear space."""
+    return _myers_range(a, 0, len(a), b, 0, len(b))
+
+
+def _unique_anchors(a, a_lo, a_hi, b, b_lo, b_hi) -> list[tuple[int, int]]:
+    """Longest increasing run of elements occurring exactly once on both sides."""
+    def unique_positions(seq, lo, hi):
+        positions = {}
+        for i in range(lo, hi):
+            positions[seq[i]] = -1 if seq[i] in positions else i
+        return positions
+
+    b_positions = unique_positions(b, b_lo, b_hi)
+    pairs = [
+        (i, b_positions[item])
+        for item, i in unique_positions(a, a_lo, a_hi).items()
+        if i != -1 and b_positions.get(item, -1) != -1
+    ]
+    pairs.sort()
+
+    # Patience sorting: pile tops hold the smallest b position ending an
+    # increasing run of each length.
+    tops = []
+    top_pairs = []
+    back = []
+    for pair in pairs:
+        pile = bisect.bisect_left(tops, pair[1])
+        back.append(top_pairs[pile - 1] if pile else None)
+        if pile == len(tops):
+            tops.append(pair[1])
+            top_pairs.append(len(back) - 1)
+        else:
+            tops[pile] = pair[1]
+            top_pairs[pile] = len(back) - 1
+
+    anchors = []
+    node = top_pairs[-1] if top_pairs else None
+    while node is not None:
+        anchors.append(pairs[node])
+        node = back[node]
+    anchors.reverse()
+    return anchors
+
+
+def patience_opcodes(a: list, b: list):
+    """Patience diff, falling back to Myers where there are no unique anchors."""
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if len(item) == 5:
+            yield item
+            continue
+
+        a_lo, a_hi, b_lo, b_hi = item
+        prefix, suffix = _common_affixes(a, a_lo, a_hi, b, b_lo, b_hi)
+        if prefix:
+            yield ('equal', a_lo, a_lo + prefix, b_lo, b_lo + prefix)
+        if suffix:
+            stack.append(('equal', a_hi - suffix, a_hi, b_hi - suffix, b_hi))
+        a_lo += prefix
+        b_lo += prefix
+        a_hi -= suffix
+        b_hi -= suffix
+
+        anchors = _unique_anchors(a, a_lo, a_hi, b, b_lo, b_hi)
+        if not anchors:
+            yield from _myers_range(a, a_lo, a_hi, b, b_lo, b_hi)
+            continue
+
+        pieces = []
+        for i, j in anchors:
+            pieces.append((a_lo, i, b_lo, j))
+            pieces.append(('equal', i, i + 1, j, j + 1))
+            a_lo, b_lo = i + 1, j + 1
+        pieces.append((a_lo, a_hi, b_lo, b_hi))
+        stack.extend(reversed(pieces))
+
+
+DIFF_BACKENDS = {
+    'difflib': difflib_opcodes,
+    'myers': myers_opcodes,
+    'patience': patience_opcodes,
+}
+DEFAULT_DIFF_BACKEND = 'myers'
+
+
+def _merged_opcodes(opcodes):
+    """Join adjacent equal opcodes, and adjacent changes into one opcode."""
+    pending = None
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 == i2 and j1 == j2:
+            continue
+        if pending is not None and (pending[0] == 'equal') == (tag == 'equal'):
+            i1, j1 = pending[1], pending[3]
+            if tag != 'equal':
+                tag = 'replace' if i1 != i2 and j1 != j2 else ('delete' if i1 != i2 else 'insert')
+        elif pending is not None:
+            yield pending
+        pending = (tag, i1, i2, j1, j2)
+    if pending is not None:
+        yield pending
+
+
+def _hunks(opcodes, context: int):
+    """Group opcodes into hunks as soon as each one is complete."""
+    hunk = []
+    changed = False
+    for tag, i1, i2, j1, j2 in _merged_opcodes(opcodes):
+        if tag != 'equal':
+            hunk.append((tag, i1, i2, j1, j2))
+            changed = True
+            continue
+        if changed and i2 - i1 > 2 * context:
+            hunk.append((tag, i1, i1 + context, j1, j1 + context))
+            yield hunk
+            hunk = []
+            changed = False
+        if changed:
+            hunk.append((tag, i1, i2, j1, j2))
+        else:
+            hunk = [(tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)]
+    if changed:
+        tag, i1, i2, j1, j2 = hunk[-1]
+        if tag == 'equal':
+            hunk[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+        yield hunk
+
+
+def _hunk_range(start: int, stop: int) -> str:
+    length = stop - start
+    if length == 1:
+        return f'{start + 1}'
+    return f'{start + 1 if length else start},{length}'
+
+
+def _instruction_line(instruction) -> str:
+    opname, argrepr, offset = instruction
+    return f'{offset:>6} {opname:<20} {argrepr}'.rstrip()
+
+
+def unified_instruction_diff(left: list, right: list, fromfile: str, tofile: str,
+                             backend: str = DEFAULT_DIFF_BACKEND, context: int = 3,
+                             interned: dict = None):
+    """Yield a unified diff of two instruction listings, hunk by hunk.
+
+    Instructions are compared on (opname, argrepr) only, interned to ints so
+    that the backends compare small ints instead of tuples of strings.
+    """
+    if interned is None:
+        interned = {}
+    a = [interned.setdefault(instr[:2], len(interned)) for instr in left]
+    b = [interned.setdefault(instr[:2], len(interned)) for instr in right]
+
+    header = [f'--- {fromfile}', f'+++ {tofile}']
+    for hunk in _hunks(DIFF_BACKENDS[backend](a, b), context):
+        yield from header
+        header = []
+        yield f'@@ -{_hunk_range(hunk[0][1], hunk[-1][2])} +{_hunk_range(hunk[0][3], hunk[-1][4])} @@'
+        for tag, i1, i2, j1, j2 in hunk:
+            if tag == 'equal':
+                for instruction in left[i1:i2]:
+                    yield ' ' + _instruction_line(instruction)
+                continue
+            for instruction in left[i1:i2]:
+                yield '-' + _instruction_line(instruction)
+            for instruction in right[j1:j2]:
+                yield '+' + _instruction_line(instruction)
+
+
+def attribute_diff(left: CodeNode, right: CodeNode):
+    """Yield a line per differing attribute of two code objects."""
+    for attr, left_value, right_value in zip(CODE_ATTRS, left.attributes, right.attributes):
+        if left_value != right_value:
+            yield (f'{ANSII_RED}{left.qualname}: {attr}: '
+                   f'{left_value!r} <> {right_value!r}{ANSII_RESET}')
+
+
+def constant_diff(left: CodeNode, right: CodeNode):
+    """Yield a line per differing constant of two code objects, like a changed docstring.
+
+    Nested code objects are compared on their own and left out.
+    """
+    for idx, (left_const, right_const) in enumerate(
+        itertools.zip_longest(left.constants, right.constants, fillvalue='-')
+    ):
+        if left_const != right_const:
+            yield (f'{ANSII_RED}{left.qualname}: constant {idx}: '
+                   f'{left_const} <> {right_const}{ANSII_RESET}')
+
+
+def diff_code_trees(left: CodeNode, right: CodeNode, left_name: str, right_name: str,
+                    backend: str = DEFAULT_DIFF_BACKEND):
+    """Yield the diff lines of the code objects that differ between two trees.
+
+    Subtrees with equal tree digests are skipped, and only code objects whose
+    own digest differs get disassembled.
+    """
+    interned = {}
+    stack = [(left, right)]
+    while stack:
+        left_node, right_node = stack.pop()
+        if left_node is None:
+            yield f'{ANSII_RED}Added: {right_node.qualname}{ANSII_RESET}'
+            continue
+        if right_node is None:
+            yield f'{ANSII_RED}Removed: {left_node.qualname}{ANSII_RESET}'
+            continue
+        if left_node.tree_digest == right_node.tree_digest:
+            continue
+
+        if left_node.digest != right_node.digest:
+            instructions_differ = False
+            for line in unified_instruction_diff(
+                left_node.instructions(),
+                right_node.instructions(),
+                fromfile=f'{left_name}:{left_node.qualname}',
+                tofile=f'{right_name}:{right_node.qualname}',
+                backend=backend,
+                interned=interned,
+            ):
+                instructions_differ = True
+                yield line
+            if not instructions_differ:
+                # Unreferenced constants, like docstrings, don't show in the listing.
+                explained = False
+                for line in attribute_diff(left_node, right_node):
+                    explained = True
+                    yield line
+                if not explained:
+                    yield from constant_diff(left_node, right_node)
+
+        stack.extend(reversed(list(_paired_children(left_node, right_node))))
+
+
+def ignored_diff(left: CodeNode, right: CodeNode):
+    """Yield a line per attribute left out of the digests that differs between two
+    trees of equal tree digests, for the first code object it differs in.
+    """
+    reported = set()
+    stack = [(left, right)]
+    while stack:
+        left_node, right_node = stack.pop()
+        for attr, left_value, right_value in zip(IGNORED_ATTRS, left_node.ignored,
+                                                 right_node.ignored):
+            if left_value != right_value and attr not in reported:
+                reported.add(attr)
+                if isinstance(left_value, bytes):
+                    yield f'{left_node.qualname}: {attr} differs'  # Not readable anyway.
+                else:
+                    yield f'{left_node.qualname}: {attr}: {left_value!r} <> {right_value!r}'
+        stack.extend(zip(reversed(left_node.children), reversed(right_node.children)))
+
+
+def header_diff(left: PycData, right: PycData, show_identical: bool = True):
+    """Yield a line per header field, or only per differing one."""
+    left_fields = {label: f'{value}{unit}' for label, value, unit in left.header_fields()}
+    right_fields = {label: f'{value}{unit}' for label, value, unit in right.header_fields()}
+    for label in {**left_fields, **right_fields}:
+        left_value = left_fields.get(label, '-')
+        right_value = right_fields.get(label, '-')
+        if left_value != right_value:
+            yield f'{ANSII_RED}{label}: {left_value} <> {right_value}{ANSII_RESET}'
+        elif show_identical:
+            yield f'{label}: {left_value} (identical)'
+
+
+def diff_pyc(left: PycData, right: PycData, backend: str = DEFAULT_DIFF_BACKEND,
+             cache: CodeTreeCache | None = None):
+    for line in header_diff(left, right):
+        print(line)
+
+    left_tree = pyc_code_tree(left, cache)
+    right_tree = pyc_code_tree(right, cache)
+    if left_tree.tree_digest != right_tree.tree_digest:
+        diff = diff_code_trees(left_tree, right_tree, left.filename, right.filename, backend)
         print(f'{ANSII_RED}Code differences:{ANSII_RESET}')
         for line in diff:
             print(line)
     else:
-        print("Code identical:")
+        differences = list(ignored_diff(left_tree, right_tree))
+        if differences:
+            print('Code equivalent, differing only in:')
+            for line in differences:
+                print(line)
+        else:
+            print("Code identical:")
         dis.dis(left.code)
 
 
+PycComparison = namedtuple('PycComparison', ['path', 'status', 'details'])
+
+IDENTICAL = 'identical'
+HEADER_DIFFERS = 'header differs'
+CODE_DIFFERS = 'code differs'
+CODE_EQUIVALENT = 'code equivalent'
+ONLY_LEFT = 'only in left'
+ONLY_RIGHT = 'only in right'
+UNREADABLE = 'unreadable'
+
+
+def compare_pyc_files(rel_path: str, left_root: Path, right_root: Path,
+                      backend: str = DEFAULT_DIFF_BACKEND,
+                      cache: CodeTreeCache | None = None) -> PycComparison:
+    """Compare one pair of files of two trees.
+
+    Code is only unmarshalled and disassembled if the bytes after the
+    header differ. Files that can't be read or parsed are reported as
+    unreadable, with the error.
+    """
+    try:
+        return _compare_pyc_files(rel_path, left_root, right_root, backend, cache)
+    except (ValueError, EOFError, OSError) as e:
+        return PycComparison(rel_path, UNREADABLE, [f'{type(e).__name__}: {e}'])
+
+
+def _compare_pyc_files(rel_path: str, left_root: Path, right_root: Path, backend: str,
+                       cache: CodeTreeCache | None) -> PycComparison:
+    left_data = (left_root / rel_path).read_bytes()
+    right_data = (right_root / rel_path).read_bytes()
+
+    if left_data[PYC_HEADER_LEN:] == right_data[PYC_HEADER_LEN:]:
+        if left_data[:PYC_HEADER_LEN] == right_data[:PYC_HEADER_LEN]:
+            return PycComparison(rel_path, IDENTICAL, [])
+        left = pyc_from_bytes(left_data, rel_path)
+        right = pyc_from_bytes(right_data, rel_path)
+        return PycComparison(rel_path, HEADER_DIFFERS, list(header_diff(left, right, False)))
+
+    left = pyc_from_bytes(left_data, rel_path)
+    right = pyc_from_bytes(right_data, rel_path)
+    details = list(header_diff(left, right, False))
+    left_tree = pyc_code_tree(left, cache)
+    right_tree = pyc_code_tree(right, cache)
+    if left_tree.tree_digest == right_tree.tree_digest:
+        # Only file names, line numbers and the like differ, or just how the
+        # code got marshalled.
+        details.extend(ignored_diff(left_tree, right_tree))
+        return PycComparison(rel_path, CODE_EQUIVALENT, details)
+    details.extend(diff_code_trees(left_tree, right_tree, 'left', 'right', backend))
+    return PycComparison(rel_path, CODE_DIFFERS, details)
+
+
+def _pyc_files(root: Path) -> set[str]:
+    return {path.relative_to(root).as_posix() for path in root.rglob('*.pyc')}
+
+
+def diff_pyc_trees(left_root: Path, right_root: Path, max_workers: int | None = None,
+                   backend: str = DEFAULT_DIFF_BACKEND, cache: CodeTreeCache | None = None):
+    """Yield a `PycComparison` for every .pyc path found in either tree.
+
+    Files are paired by their path relative to the roots and compared on a
+    process pool.
+    """
+    left_files = _pyc_files(left_root)
+    right_files = _pyc_files(right_root)
+    common = sorted(left_files & right_files)
+
+    for rel_path in sorted(left_files - right_files):
+        yield PycComparison(rel_path, ONLY_LEFT, [])
+    for rel_path in sorted(right_files - left_files):
+        yield PycComparison(rel_path, ONLY_RIGHT, [])
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(common) // (max_workers * 8))
+    with ProcessPoolExecutor(max_workers) as pool:
+        yield from pool.map(
+            compare_pyc_files,
+            common,
+            [left_root] * len(common),
+            [right_root] * len(common),
+            [backend] * len(common),
+            [cache] * len(common),
+            chunksize=chunksize,
+        )
+
+
+def view_tree_diff(left_root: Path, right_root: Path, backend: str = DEFAULT_DIFF_BACKEND,
+                   cache: CodeTreeCache | None = None):
+    counts = dict.fromkeys(
+        (IDENTICAL, HEADER_DIFFERS, CODE_EQUIVALENT, CODE_DIFFERS, ONLY_LEFT, ONLY_RIGHT,
+         UNREADABLE), 0
+    )
+    for comparison in diff_pyc_trees(left_root, right_root, backend=backend, cache=cache):
+        counts[comparison.status] += 1
+        if comparison.status == IDENTICAL:
+            continue
+        print(f'{ANSII_RED}{comparison.path}: {comparison.status}{ANSII_RESET}')
+        for line in comparison.details:
+            print(f'    {line}')
+
+    print()
+    print(f'Compared {sum(counts.values())} files:')
+    for status, count in counts.items():
+        print(f'    {status}: {count}')
+
+
+FunctionProfile = namedtuple('FunctionProfile', ['qualname', 'instructions', 'consts', 'nested_code', 'opcodes'])
+# `error` is set, and everything else is empty, for pycs that couldn't be read.
+ModuleProfile = namedtuple('ModuleProfile', ['path', 'instructions', 'consts', 'nested_code', 'opcodes', 'functions', 'error'],
+                           defaults=[None])
+
+CACHE_OPCODE = dis.opmap.get('CACHE')
+
+
+def _empty_histogram() -> array:
+    return array('L', bytes(256 * array('L').itemsize))
+
+
+def opcode_counts(code: types.CodeType) -> dict[int, int]:
+    """Count of each opcode in a code object.
+
+    Instructions are two bytes wide, so the opcodes are every other byte of
+    co_code and each distinct one gets counted with a single bytes.count().
+    """
+    opcodes = code.co_code[::2]
+    counts = {opcode: opcodes.count(opcode) for opcode in set(opcodes)}
+    counts.pop(CACHE_OPCODE, None)
+    return counts
+
+
+def profile_pyc(path: Path) -> ModuleProfile:
+    """Sizes and opcode counts of a module and of every code object in it.
+
+    Functions only carry the opcodes they use, the module totals are a dense
+    histogram indexed by opcode.
+    """
+    histogram = _empty_histogram()
+    functions = []
+    try:
+        stack = [pyc_info(path).code]
+    except (ValueError, EOFError, OSError) as e:
+        return ModuleProfile(str(path), 0, 0, 0, histogram, [], f'{type(e).__name__}: {e}')
+    while stack:
+        code = stack.pop()
+        nested = [const for const in code.co_consts if isinstance(const, types.CodeType)]
+        counts = opcode_counts(code)
+        for opcode, count in counts.items():
+            histogram[opcode] += count
+        functions.append(FunctionProfile(
+            qualname=getattr(code, 'co_qualname', code.co_name),
+            instructions=sum(counts.values()),
+            consts=len(code.co_consts),
+            nested_code=len(nested),
+            opcodes=counts,
+        ))
+        stack.extend(reversed(nested))
+
+    return ModuleProfile(
+        path=str(path),
+        instructions=sum(histogram),
+        consts=sum(function.consts for function in functions),
+        nested_code=len(functions) - 1,
+        opcodes=histogram,
+        functions=functions,
+    )
+
+
+def _named_opcodes(counts) -> dict[str, int]:
+    if isinstance(counts, array):
+        counts = {opcode: count for opcode, count in enumerate(counts) if count}
+    return {dis.opname[opcode]: count for opcode, count in sorted(counts.items())}
+
+
+def profile_pycs(paths: list, max_workers: int | None = None):
+    """Yield a `ModuleProfile` of every pyc in `paths`, directories included."""
+    files = []
+    for path in paths:
+        files.extend(sorted(path.rglob('*.pyc')) if path.is_dir() else [path])
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (max_workers * 8))
+    with ProcessPoolExecutor(max_workers) as pool:
+        yield from pool.map(profile_pyc, files, chunksize=chunksize)
+
+
+def write_profile_json(modules, stream):
+    totals = _empty_histogram()
+    report = []
+    errors = []
+    for module in modules:
+        if module.error is not None:
+            errors.append({'path': module.path, 'error': module.error})
+            continue
+        for opcode, count in enumerate(module.opcodes):
+            totals[opcode] += count
+        report.append({
+            'path': module.path,
+            'instructions': module.instructions,
+            'consts': module.consts,
+            'nested_code': module.nested_code,
+            'opcodes': _named_opcodes(module.opcodes),
+            'functions': [
+                {
+                    'qualname': function.qualname,
+                    'instructions': function.instructions,
+                    'consts': function.consts,
+                    'nested_code': function.nested_code,
+                    'opcodes': _named_opcodes(function.opcodes),
+                }
+                for function in module.functions
+            ],
+        })
+    # json.dump() never uses the C encoder, json.dumps() without indent does.
+    stream.write(json.dumps(
+        {'modules': report, 'opcodes': _named_opcodes(totals), 'errors': errors}
+    ))
+    stream.write('\n')
+
+
+def write_profile_csv(modules, stream):
+    """One row per module, with an empty qualname, followed by its functions.
+
+    Every opcode of the current interpreter gets a column. Pycs that couldn't
+    be read get a row with only their path and the error, in the last column.
+    """
+    columns = [opcode for opcode, name in enumerate(dis.opname)
+               if not name.startswith('<') and opcode != CACHE_OPCODE]
+    writer = csv.writer(stream)
+    writer.writerow(['path', 'qualname', 'instructions', 'consts', 'nested_code']
+                    + [dis.opname[opcode] for opcode in columns] + ['error'])
+    for module in modules:
+        if module.error is not None:
+            writer.writerow([module.path] + [''] * (len(columns) + 4) + [module.error])
+            continue
+        writer.writerow([module.path, '', module.instructions, module.consts, module.nested_code]
+                        + [module.opcodes[opcode] for opcode in columns] + [''])
+        for function in module.functions:
+            histogram = _empty_histogram()
+            for opcode, count in function.opcodes.items():
+                histogram[opcode] = count
+            writer.writerow([module.path, function.qualname, function.instructions,
+                             function.consts, function.nested_code]
+                            + [histogram[opcode] for opcode in columns] + [''])
+
+
+PROFILE_FORMATS = {
+    'json': write_profile_json,
+    'csv': write_profile_csv,
+}
+
+
+PycStatus = namedtuple('PycStatus', ['source', 'pyc', 'status', 'reason'])
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISSING = 'missing'
+ORPHANED = 'orphaned'
+
+PYCACHE = '__pycache__'
+# module.cpython-311.pyc, or module.cpython-311.opt-1.pyc for -O and -OO.
+PYC_NAME_RE = re.compile(rf'(.+)\.{re.escape(sys.implementation.cache_tag)}(?:\.opt-\w+)?\.pyc')
+
+
+def check_pyc(source: str, pyc: str) -> PycStatus:
+    """Check the header of a pyc against its source, the way the importer does.
+
+    Unchecked hash-based pycs are never validated against the source by the
+    importer, so only their magic number is checked. Pycs with a broken header
+    and pycs or sources that can't be read are stale as well.
+    """
+    try:
+        return _check_pyc(source, pyc)
+    except ValueError:
+        return PycStatus(source, pyc, STALE, 'bad header')
+    except OSError:
+        return PycStatus(source, pyc, STALE, 'unreadable')
+
+
+def _check_pyc(source: str, pyc: str) -> PycStatus:
+    header = pyc_info(Path(pyc), header_only=True)
+    if header.magic != importlib.util.MAGIC_NUMBER.hex():
+        return PycStatus(source, pyc, STALE, f'magic {header.magic}')
+
+    if not header.hash_based:
+        stat = os.stat(source)
+        # Both are stored modulo 2**32.
+        if header.mtime != int(stat.st_mtime) & 0xFFFFFFFF:
+            return PycStatus(source, pyc, STALE, 'mtime')
+        if header.source_size != stat.st_size & 0xFFFFFFFF:
+            return PycStatus(source, pyc, STALE, 'size')
+    elif header.check_source:
+        with open(source, 'rb') as f:
+            if header.source_hash != importlib.util.source_hash(f.read()):
+                return PycStatus(source, pyc, STALE, 'source hash')
+    return PycStatus(source, pyc, FRESH, None)
+
+
+def _walk_modules(root: str):
+    """Yield (source, pyc) pairs of a source tree, with None for either if missing.
+
+    A source compiled at several optimization levels is paired with each of
+    its pycs.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        sources = {}
+        pycache = None
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name == PYCACHE:
+                    pycache = entry.path
+                elif entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.py'):
+                    sources[entry.name[:-3]] = entry.path
+
+        pycs = {}
+        if pycache is not None:
+            with os.scandir(pycache) as entries:
+                for entry in entries:
+                    match = PYC_NAME_RE.fullmatch(entry.name)
+                    if match:
+                        pycs.setdefault(match[1], []).append(entry.path)
+
+        for name, source in sources.items():
+            module_pycs = pycs.pop(name, None)
+            if module_pycs is None:
+                yield source, None
+            for pyc in module_pycs or ():
+                yield source, pyc
+        for module_pycs in pycs.values():
+            for pyc in module_pycs:
+                yield None, pyc
+
+
+def scan_pycs(root: str, max_workers: int | None = None):
+    """Yield a `PycStatus` for every module and every pyc found under `root`.
+
+    Only the pycs of the running interpreter's cache tag are considered, at
+    any optimization level, and only their headers get read.
+    """
+    to_check = []
+    for source, pyc in _walk_modules(root):
+        if pyc is None:
+            yield PycStatus(source, None, MISSING, None)
+        elif source is None:
+            yield PycStatus(None, pyc, ORPHANED, None)
+        else:
+            to_check.append((source, pyc))
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        yield from pool.map(lambda pair: check_pyc(*pair), to_check)
+
+
+def view_stale(root: str):
+    counts = dict.fromkeys((FRESH, STALE, MISSING, ORPHANED), 0)
+    for source, pyc, status, reason in scan_pycs(root):
+        counts[status] += 1
+        if status == FRESH:
+            continue
+        line = f'{status}: {source or pyc}'
+        if reason is not None:
+            line += f' ({reason})'
+        print(line)
+
+    print()
+    print(f'Scanned {sum(counts.values())} modules:')
+    for status, count in counts.items():
+        print(f'    {status}: {count}')
+
+
+USAGE = f"""\
+Usage: python pycdiff.py [--diff=<backend>] [--no-cache] <pyc_file1> [<pyc_file2>]
+       python pycdiff.py header <pyc_file>...
+       python pycdiff.py stale <source_dir>
+       python pycdiff.py profile [--format=json|csv] <pyc_file_or_dir>...
+       python pycdiff.py [--diff=<backend>] [--no-cache] tree <left_dir> <right_dir>
+
+Diff backends: {', '.join(DIFF_BACKENDS)} (default: {DEFAULT_DIFF_BACKEND})
+Parsed code is cached in $PYCDIFF_CACHE_DIR, by default ~/.cache/pycdiff."""
+
+
 if __name__ == '__main__':
     args = sys.argv[1:]
-    if len(args) == 1:
+    options = {}
+    while args and args[0].startswith('--'):
+        name, _, value = args.pop(0)[2:].partition('=')
+        options[name] = value
+    backend = options.pop('diff', DEFAULT_DIFF_BACKEND)
+    cache = None if options.pop('no-cache', None) is not None else CodeTreeCache.default()
+    if options or backend not in DIFF_BACKENDS:
+        print(USAGE)
+        sys.exit(1)
+
+    if args and args[0] == 'tree':
+        if len(args) != 3:
+            print(USAGE)
+            sys.exit(1)
+        with cache or nullcontext():
+            view_tree_diff(Path(args[1]), Path(args[2]), backend, cache)
+    elif args and args[0] == 'stale':
+        if len(args) != 2:
+            print(USAGE)
+            sys.exit(1)
+        view_stale(args[1])
+    elif args and args[0] == 'profile':
+        report_format = 'json'
+        if len(args) > 1 and args[1].startswith('--format='):
+            report_format = args.pop(1)[len('--format='):]
+        if len(args) < 2 or report_format not in PROFILE_FORMATS:
+            print(USAGE)
+            sys.exit(1)
+        PROFILE_FORMATS[report_format](profile_pycs([Path(arg) for arg in args[1:]]), sys.stdout)
+    elif args and args[0] == 'header':
+        view_headers([Path(arg) for arg in args[1:]])
+    elif len(args) == 1:
         pyc = pyc_info(Path(args[0]))
     elif len(args) == 2:
         left_pyc = pyc_info(Path(args[0]))
         right_pyc = pyc_info(Path(args[1]))
-        diff_pyc(left_pyc, right_pyc)
+        with cache or nullcontext():
+            diff_pyc(left_pyc, right_pyc, backend, cache)
     else:
-        print('Usage: python pycdiff.py <pyc_file1> [<pyc_file2>]')
+        print(USAGE)
         sys.exit(1)
@@ -0,0 +1,108 @@
+"""
+Measures build time and memory per node of the scope trees, over all modules
+of a directory (the standard library by default).
+
+Symbol tables and ASTs are created before the measurements start, so that
+only the scope tree nodes themselves are accounted for. Run it on different
+revisions of this directory to compare them.
+"""
+
+from __future__ import annotations
+
+import ast
+import symtable
+import sys
+import sysconfig
+import time
+import tracemalloc
+from pathlib import Path
+
+import scopetree
+import scopetree_with_ast
+
+
+def _full_walk(root) -> int:
+    """Number of nodes in the tree, building all of them on the way."""
+    count = 1
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += len(node.children)
+        stack.extend(node.children)
+    return count
+
+
+def _all_tables(symbols: symtable.SymbolTable) -> list[symtable.SymbolTable]:
+    tables = []
+    stack = [symbols]
+    while stack:
+        table = stack.pop()
+        tables.append(table)
+        stack.extend(table.get_children())
+    return tables
+
+
+def _inputs(directory: Path):
+    for path in sorted(directory.rglob("*.py")):
+        try:
+            code = path.read_text(encoding="utf-8")
+            symbols = symtable.symtable(code, str(path), "exec")
+            ast_tree = ast.parse(code)
+        except (SyntaxError, UnicodeDecodeError, ValueError, RecursionError):
+            continue
+        # symtable creates the child table objects on first access and only
+        # caches them while they're alive, so they're kept around here.
+        yield str(path), symbols, ast_tree, _all_tables(symbols)
+
+
+def bench(directory: Path) -> None:
+    inputs = list(_inputs(directory))
+    builders = {
+        "scopetree": lambda path, symbols, ast_tree: scopetree.ScopeTreeRoot(symbols, path),
+        "scopetree_with_ast": lambda path, symbols, ast_tree: scopetree_with_ast.ScopeTreeRoot(
+            symbols, ast_tree, path
+        ),
+    }
+
+    print(f"{len(inputs)} modules in {directory}")
+    for name, build in builders.items():
+        # Timed without tracemalloc, which slows down allocations a lot.
+        start = time.perf_counter()
+        for path, symbols, ast_tree, _ in inputs:
+            _full_walk(build(path, symbols, ast_tree))
+        elapsed = time.perf_counter() - start
+
+        trees = []
+        nodes = 0
+        tracemalloc.start()
+        for path, symbols, ast_tree, _ in inputs:
+            tree = build(path, symbols, ast_tree)
+            nodes += _full_walk(tree)
+            trees.append(tree)
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{name}: {nodes} nodes in {elapsed:.2f}s, "
+            f"{elapsed / nodes * 1e6:.1f}us and {allocated / nodes:.0f} bytes per node"
+        )
+        del trees
+
+
+USAGE = f"Usage: {sys.argv[0]} [<directory>]"
+MAXARGS = 2
+MINARGS = 1
+
+
+def main(args: list[str]):
+    directory = Path(args[0]) if args else Path(sysconfig.get_paths()["stdlib"])
+    bench(directory)
+
+
+if __name__ == "__main__":
+    if not (MINARGS <= len(sys.argv) <= MAXARGS):
+        print(USAGE)
+        sys.exit(1)
+
+    sys.argv.pop(0)
+    main(sys.argv)
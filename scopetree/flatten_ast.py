@@ -1,24 +1,262 @@
 """
-Flattens AST tree into a well-ordered list of nodes. Only expressions and
-statements are present in the list.
+Flattens AST tree into a well-ordered list of nodes. Only expressions,
+statements and arguments are present in the list.
 
-Nodes listed earlier have line numbers lower than those that follow.
+Nodes listed earlier have positions (line number and column offset) lower
+than those that follow. Also has the helpers telling which parts of scoped
+nodes belong to which scope.
 """
 
 from __future__ import annotations
 
 import ast
+import heapq
+import itertools
 import sys
 from pprint import pprint
 
+EXPR_NAMES = (
+    "lambda",
+    "listcomp",
+    "setcomp",
+    "dictcomp",
+    "genexpr",
+)
 
-def flatten_ast(tree: ast.AST):
-    nodes = [
-        node
-        for node in ast.walk(tree)
-        if isinstance(node, (ast.stmt, ast.expr, ast.arg))
-    ]
-    return sorted(nodes, key=lambda n: n.lineno)
+SCOPED_EXPR = (
+    ast.Lambda,
+    ast.ListComp,
+    ast.SetComp,
+    ast.DictComp,
+    ast.GeneratorExp,
+)
+
+SCOPED_STMT = (
+    ast.FunctionDef,
+    ast.AsyncFunctionDef,
+    ast.ClassDef,
+)
+
+SCOPED_NODES = SCOPED_STMT + SCOPED_EXPR
+SCOPE_NAMES = dict(zip(SCOPED_EXPR, EXPR_NAMES))
+
+
+def scope_name(node: ast.AST) -> str:
+    """Name of the symbol table created for a scoped statement or expression."""
+    if isinstance(node, SCOPED_STMT):
+        return node.name
+    return SCOPE_NAMES[type(node)]
+
+
+def has_future_annotations(tree: ast.Module) -> bool:
+    return any(
+        isinstance(stmt, ast.ImportFrom)
+        and stmt.module == "__future__"
+        and any(alias.name == "annotations" for alias in stmt.names)
+        for stmt in tree.body
+    )
+
+
+def _annotations(args: ast.arguments, returns: ast.expr | None) -> list[ast.expr]:
+    # Same order as symtable_visit_annotations() in CPython.
+    annotated = [*args.posonlyargs, *args.args]
+    annotated += [arg for arg in (args.vararg, args.kwarg) if arg is not None]
+    annotated += args.kwonlyargs
+    annotations = [arg.annotation for arg in annotated if arg.annotation is not None]
+    if returns is not None:
+        annotations.append(returns)
+    return annotations
+
+
+def _outer_parts(node: ast.AST, future_annotations: bool) -> list[ast.AST]:
+    """Parts of a scoped node that symtable visits in the enclosing scope, in order."""
+    if isinstance(node, ast.ClassDef):
+        return [*node.bases, *node.keywords, *node.decorator_list]
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+        # Only the first iterator of a comprehension is evaluated outside of it.
+        return [node.generators[0].iter]
+
+    args = node.args
+    parts = [*args.defaults, *filter(None, args.kw_defaults)]
+    if isinstance(node, ast.Lambda):
+        return parts
+    # Postponed annotations get scopes of their own, which symtable doesn't
+    # list among the children.
+    if not future_annotations:
+        parts += _annotations(args, node.returns)
+    return parts + node.decorator_list
+
+
+def _inner_parts(node: ast.AST) -> list[ast.AST]:
+    """Parts of a scope-creating node that symtable visits within its scope, in order."""
+    if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.body
+    if isinstance(node, ast.Lambda):
+        return [node.body]
+
+    first, *rest = node.generators
+    parts = [first.target, *first.ifs]
+    for generator in rest:
+        parts += [generator.target, generator.iter, *generator.ifs]
+    if isinstance(node, ast.DictComp):
+        return parts + [node.value, node.key]
+    return parts + [node.elt]
+
+
+# Nodes that never contain a scope, not worth descending into.
+LEAF_NODES = (
+    ast.Name,
+    ast.Constant,
+    ast.Pass,
+    ast.Break,
+    ast.Continue,
+    ast.Import,
+    ast.ImportFrom,
+    ast.Global,
+    ast.Nonlocal,
+    ast.expr_context,
+    ast.operator,
+    ast.unaryop,
+    ast.boolop,
+    ast.cmpop,
+)
+TRY_NODES = (ast.Try, ast.TryStar) if hasattr(ast, "TryStar") else (ast.Try,)
+
+
+def _child_parts(node: ast.AST, future_annotations: bool) -> list[ast.AST]:
+    if isinstance(node, TRY_NODES):
+        return [*node.body, *node.orelse, *node.handlers, *node.finalbody]
+    if isinstance(node, ast.AnnAssign) and future_annotations:
+        return [node.target, node.value] if node.value is not None else [node.target]
+
+    parts = []
+    for field in node._fields:
+        value = getattr(node, field, None)
+        if isinstance(value, list):
+            parts += [item for item in value if isinstance(item, ast.AST)]
+        elif isinstance(value, ast.AST):
+            parts.append(value)
+    return parts
+
+
+def child_scope_nodes(scope_node: ast.AST, future_annotations: bool = False):
+    """Yield the scoped nodes directly within a scope, in the order symtable creates their tables.
+
+    `scope_node` is a module or a scoped node. Nodes nested in the yielded
+    ones are not descended into.
+    """
+    stack = list(reversed(_inner_parts(scope_node)))
+    while stack:
+        node = stack.pop()
+        if type(node) is tuple:
+            yield node[0]
+        elif isinstance(node, LEAF_NODES):
+            continue
+        elif isinstance(node, SCOPED_NODES):
+            # The scope itself is created after its outer parts are visited.
+            stack.append((node,))
+            stack.extend(reversed(_outer_parts(node, future_annotations)))
+        else:
+            stack.extend(reversed(_child_parts(node, future_annotations)))
+
+
+FLATTENED_NODES = (ast.stmt, ast.expr, ast.arg)
+DECORATED_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# States of the nodes queued in iter_ast()
+_FRESH = 0
+_DECORATED = 1  # Queued at its first decorator, which comes before the node.
+_DECORATORS_QUEUED = 2
+_NO_CHILDREN = 3
+_UNPRUNED = 4  # Within a postponed annotation, which has no scopes in the tree.
+
+
+def _parameters(node: ast.AST) -> list[ast.arg]:
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+        return []
+    args = node.args
+    parameters = [*args.posonlyargs, *args.args]
+    if args.vararg is not None:
+        parameters.append(args.vararg)
+    parameters += args.kwonlyargs
+    if args.kwarg is not None:
+        parameters.append(args.kwarg)
+    return parameters
+
+
+def iter_ast(tree: ast.AST, prune_scopes: bool = False, future_annotations: bool = False):
+    """Lazily yield the nodes of `tree` ordered by (lineno, col_offset).
+
+    Children of a node are merged into the ones still pending on a heap, so
+    only the frontier of the walk is kept in memory and nothing gets sorted as
+    a whole. Nodes at the same position come parent first. To get all of
+    them as a list, flatten_ast() is faster.
+
+    With `prune_scopes`, nested functions, classes, lambdas and comprehensions
+    are yielded but not descended into, apart from their parts evaluated in
+    the enclosing scope, like decorators and default values. If `tree` itself
+    is a scoped node, only its parameters and its body are yielded then.
+    Postponed annotations, as in modules with `future_annotations`, are
+    descended into anyway, their scopes aren't children of the enclosing one.
+    """
+    heap = []
+    order = itertools.count()
+
+    def push(nodes, state=_FRESH):
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            if "lineno" not in node._attributes:
+                # arguments, comprehensions, withitems, ... only group other nodes.
+                stack.extend(ast.iter_child_nodes(node))
+            elif state == _FRESH and isinstance(node, DECORATED_NODES) and node.decorator_list:
+                key = node.decorator_list[0]
+                heapq.heappush(heap, (key.lineno, key.col_offset, next(order), _DECORATED, node))
+            else:
+                heapq.heappush(heap, (node.lineno, node.col_offset, next(order), state, node))
+
+    if prune_scopes and isinstance(tree, SCOPED_NODES):
+        push(_parameters(tree), _NO_CHILDREN)
+        push(_inner_parts(tree))
+    else:
+        push([tree])
+
+    while heap:
+        _, _, _, state, node = heapq.heappop(heap)
+        if state == _DECORATED:
+            push(node.decorator_list)
+            push([node], _DECORATORS_QUEUED)
+            continue
+
+        if isinstance(node, FLATTENED_NODES):
+            yield node
+        if state == _NO_CHILDREN:
+            continue
+        if state == _UNPRUNED:
+            push(ast.iter_child_nodes(node), _UNPRUNED)
+            continue
+
+        if prune_scopes and isinstance(node, SCOPED_NODES):
+            children = _outer_parts(node, future_annotations)
+            if future_annotations and isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                push(_annotations(node.args, node.returns), _UNPRUNED)
+        elif prune_scopes and future_annotations and isinstance(node, ast.AnnAssign):
+            push([node.annotation], _UNPRUNED)
+            children = [node.target] if node.value is None else [node.target, node.value]
+        else:
+            children = list(ast.iter_child_nodes(node))
+        if state == _DECORATORS_QUEUED:
+            decorators = set(map(id, node.decorator_list))
+            children = [child for child in children if id(child) not in decorators]
+        push(children)
+
+
+def flatten_ast(tree: ast.AST) -> list[ast.AST]:
+    # Walking everything and sorting once beats merging on a heap when the
+    # whole list is wanted anyway. Sorting is stable, so nodes at the same
+    # position keep ast.walk()'s parent first order.
+    nodes = [node for node in ast.walk(tree) if isinstance(node, FLATTENED_NODES)]
+    return sorted(nodes, key=lambda n: (n.lineno, n.col_offset))
 
 
 USAGE = f"Usage: {sys.argv[0]} <path>"
@@ -5,36 +5,64 @@ using the same name.
 
 from __future__ import annotations
 
+import json
 import symtable
 import sys
-import textwrap
 
 
 class ScopeTreeNode:
+    __slots__ = ("symbols", "parent", "qualname", "_children", "_children_by_name")
+
     def __init__(
         self,
         symbols: symtable.SymbolTable,
         parent: ScopeTreeNode | None,
     ) -> None:
         self.symbols = symbols
-        self.children = []
-        self.child_names = []
         self.parent = parent
+        self.qualname = "" if parent is None else f"{parent.qualname}.{self.name}"
+        self._children: list[ScopeTreeNode] | None = None
+        self._children_by_name: dict[str, list[ScopeTreeNode]] | None = None
+
+    @property
+    def children(self) -> list[ScopeTreeNode]:
+        # Built on first access, one level at a time, so that building a tree
+        # never recurses and subtrees nobody looks at cost nothing.
+        if self._children is None:
+            # The children symbol tables aren't necessarily ordered by their line numbers.
+            # Consider the following code:
+            #
+            #     @lambda func: None
+            #     def same_lineno() -> lambda: None:
+            #         pass
+            #
+            # The decorator lambda will come after the returntype lambda.
+            children = sorted(self.symbols.get_children(), key=lambda s: s.get_lineno())
+            self._children = [ScopeTreeNode(child, self) for child in children]
+        return self._children
 
-        # The children symbol tables aren't necessarily ordered by their line numbers.
-        # Consider the following code:
-        #
-        #     @lambda func: None
-        #     def same_lineno() -> lambda: None:
-        #         pass
-        #
-        # The decorator lambda will come after the returntype lambda.
-        children = sorted(symbols.get_children(), key=lambda s: s.get_lineno())
-
-        for child in children:
-            new_node = ScopeTreeNode(child, self)
-            self.children.append(new_node)
-            self.child_names.append(new_node.name)
+    @property
+    def child_names(self) -> list[str]:
+        return [child.name for child in self.children]
+
+    def children_named(self, name: str) -> list[ScopeTreeNode]:
+        """Children with the given name, in order, including the shadowed ones."""
+        if self._children_by_name is None:
+            self._children_by_name = {}
+            for child in self.children:
+                self._children_by_name.setdefault(child.name, []).append(child)
+        return self._children_by_name.get(name, [])
+
+    def walk(self):
+        """Iterate over the subtree nodes.
+
+        Returns the subtree's nodes excluding this one, in the order of their linenos.
+        """
+        stack = [*(reversed(self.children))]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def __str__(self):
         symbols = self.symbols.get_symbols()
@@ -44,10 +72,6 @@ class ScopeTreeNode:
     def name(self) -> str:
         return self.symbols.get_name()
 
-    @property
-    def qualname(self) -> str:
-        return self.parent.qualname + "." + self.name if self.parent is not None else ""
-
     @property
     def kind(self) -> str:
         return self.symbols.get_type()
@@ -56,30 +80,78 @@ class ScopeTreeNode:
     def lineno(self) -> int:
         return self.symbols.get_lineno()
 
-    def tree_str(self) -> str:
-        tree_str = ""
-        for child_idx, child in enumerate(self.children):
-            tree_str += f"\n{child_idx}: {child.tree_str()}"
+    def to_json(self) -> dict:
+        return {
+            "kind": self.kind,
+            "qualname": self.qualname,
+            "lineno": self.lineno,
+            "symbols": [symbol.get_name() for symbol in self.symbols.get_symbols()],
+        }
+
+    def iter_tree(self):
+        """Yield (depth, child index, node) of the subtree, in tree_str() order.
+
+        The child index of this node is None.
+        """
+        stack = [(0, None, self)]
+        while stack:
+            depth, child_idx, node = stack.pop()
+            yield depth, child_idx, node
+            children = node.children
+            for idx in range(len(children) - 1, -1, -1):
+                stack.append((depth + 1, idx, children[idx]))
+
+    def iter_tree_lines(self):
+        for depth, child_idx, node in self.iter_tree():
+            if child_idx is None:
+                yield f"{node!s}"
+            else:
+                yield f"{'    ' * depth}{child_idx}: {node!s}"
+
+    def write_tree(self, stream, json_lines: bool = False) -> None:
+        """Write the tree_str() lines, or a JSON object per node, to `stream`."""
+        if json_lines:
+            for depth, child_idx, node in self.iter_tree():
+                stream.write(json.dumps({"depth": depth, "index": child_idx, **node.to_json()}))
+                stream.write("\n")
+        else:
+            for line in self.iter_tree_lines():
+                stream.write(line)
+                stream.write("\n")
 
-        tree_str = textwrap.indent(tree_str, "    ")
-        return f"{self!s}" + tree_str
+    def tree_str(self) -> str:
+        return "\n".join(self.iter_tree_lines())
 
 
 class ScopeTreeRoot(ScopeTreeNode):
+    __slots__ = ("path", "_by_qualname")
+
     def __init__(self, symbols: symtable.SymbolTable, path: str | None = None) -> None:
         if path is None:
             path = "<unnamed module>"
         self.path = path
+        self._by_qualname: dict[str, list[ScopeTreeNode]] | None = None
 
         super().__init__(symbols, None)
 
     def __str__(self):
         return f"Global scope ({self.path})"
 
+    def to_json(self) -> dict:
+        return {**super().to_json(), "path": self.path}
+
     @property
     def name(self) -> str:
         return "."
 
+    def find_qualname(self, qualname: str) -> list[ScopeTreeNode]:
+        """Scopes with the given qualname, in order, including the shadowed ones."""
+        if self._by_qualname is None:
+            self._by_qualname = {self.qualname: [self]}
+            for node in self.walk():
+                self._by_qualname.setdefault(node.qualname, []).append(node)
+        return self._by_qualname.get(qualname, [])
+
     @classmethod
     def from_file(cls, path: str) -> ScopeTreeRoot:
         with open(path, "r", encoding="utf-8") as f:
@@ -88,14 +160,19 @@ class ScopeTreeRoot(ScopeTreeNode):
         return ScopeTreeRoot(symbols, path)
 
 
-USAGE = f"Usage: {sys.argv[0]} <path>"
-MAXARGS = 2
+USAGE = f"Usage: {sys.argv[0]} [--json] <path>"
+MAXARGS = 3
 MINARGS = 2
 
 
 def main(args: list[str]):
-    path = args[0]
-    print(ScopeTreeRoot.from_file(path).tree_str())
+    json_lines = args[0] == "--json"
+    if json_lines:
+        args.pop(0)
+    if len(args) != 1:
+        print(USAGE)
+        sys.exit(1)
+    ScopeTreeRoot.from_file(args[0]).write_tree(sys.stdout, json_lines)
 
 
 if __name__ == "__main__":
@@ -2,69 +2,281 @@
 Generates a tree of scopes present in the code, including scopes shadowed by
 using the same name.
 
-This version adds AST node information to each found scope. This depends on the
-fact that the child tables returned by the symtable nodes are ordered in the
-same way as the AST nodes used to create them.
+This version adds AST node information to each found scope. Symbol tables
+carry no column offsets, so the AST of each scope is walked in the order in
+which symtable visits it, and the scope-creating nodes found on the way are
+paired with the child tables of the same line number and name.
+
+Each scope also indexes the names occurring in its own part of the code, for
+looking up where a symbol is used. Together with the symbol tables, these
+resolve which variable a name refers to, following closures, `nonlocal` and
+`global` declarations.
 """
 
 from __future__ import annotations
 
 import ast
+import heapq
+import json
 import symtable
 import sys
-import textwrap
-
-from flatten_ast import flatten_ast
-
-EXPR_NAMES = (
-    "lambda",
-    "listcomp",
-    "setcomp",
-    "dictcomp",
-    "genexpr",
-)
-
-SCOPED_EXPR = (
-    ast.Lambda,
-    ast.ListComp,
-    ast.SetComp,
-    ast.DictComp,
-    ast.GeneratorExp,
+from bisect import bisect_left
+from collections import deque, namedtuple
+
+from flatten_ast import (
+    child_scope_nodes,
+    has_future_annotations,
+    iter_ast,
+    scope_name,
 )
 
-SCOPED_STMT = (
-    ast.FunctionDef,
-    ast.AsyncFunctionDef,
-    ast.ClassDef,
-)
+# ctx is "load", "store" or "del" for names, "param" for parameters and
+# "def" for the names of functions and classes.
+Occurrence = namedtuple("Occurrence", "lineno, col_offset, ctx")
+Reference = namedtuple("Reference", "scope, occurrence")
+# Everything referring to the variable `name` bound in `scope`. Definitions
+# are the occurrences that bind or delete it, uses are the ones loading it.
+DefUseChain = namedtuple("DefUseChain", "name, scope, definitions, uses")
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def mangle(name: str, class_name: str | None) -> str:
+    """Name as the compiler, and the symbol tables, see it within a class."""
+    if class_name is None or not name.startswith("__") or name.endswith("__") or "." in name:
+        return name
+    class_name = class_name.lstrip("_")
+    if not class_name:
+        return name
+    return f"_{class_name}{name}"
+
+
+def index_names(
+    scope_node: ast.AST, future_annotations: bool = False, class_name: str | None = None
+) -> dict[str, list[Occurrence]]:
+    """Occurrences of each name in a scope, without the scopes nested in it.
+
+    Occurrences of a name are sorted by their position. Within a class,
+    `class_name` is the name of the innermost class, and private names are
+    indexed in their mangled form.
+    """
+    index: dict[str, list[Occurrence]] = {}
+    for node in iter_ast(scope_node, prune_scopes=True, future_annotations=future_annotations):
+        if isinstance(node, ast.Name):
+            name, ctx = node.id, type(node.ctx).__name__.lower()
+        elif isinstance(node, ast.arg):
+            name, ctx = node.arg, "param"
+        elif isinstance(node, DEFINITIONS):
+            name, ctx = node.name, "def"
+        else:
+            continue
+        name = mangle(name, class_name)
+        index.setdefault(name, []).append(Occurrence(node.lineno, node.col_offset, ctx))
+    return index
+
+
+def _start(node: ast.AST) -> tuple[int, int]:
+    if isinstance(node, DEFINITIONS) and node.decorator_list:
+        node = node.decorator_list[0]
+    return node.lineno, node.col_offset
+
+
+def _encloses(outer: ast.AST, inner: ast.AST) -> bool:
+    return (
+        _start(outer) <= _start(inner)
+        and (inner.end_lineno, inner.end_col_offset) <= (outer.end_lineno, outer.end_col_offset)
+    )
+
+
+def _within(occurrences: list[Occurrence], node: ast.AST) -> list[Occurrence]:
+    """The part of sorted occurrences that lies within the source of a node."""
+    start = bisect_left(occurrences, _start(node))
+    end = bisect_left(occurrences, (node.end_lineno, node.end_col_offset))
+    return occurrences[start:end]
 
 
 class ScopeTreeNode:
+    __slots__ = (
+        "symbols",
+        "parent",
+        "qualname",
+        "ast_node",
+        "_children",
+        "_children_by_name",
+        "_names",
+        "_span",
+    )
+
     def __init__(
         self,
         symbols: symtable.SymbolTable,
         parent: ScopeTreeNode | None,
     ) -> None:
         self.symbols = symbols
-        self.children = []
-        self.child_names = []
         self.parent = parent
+        self.qualname = "" if parent is None else f"{parent.qualname}.{self.name}"
         self.ast_node: ast.AST = None  # Assigned by ScopeTreeRoot
+        self._children: list[ScopeTreeNode] | None = None
+        self._children_by_name: dict[str, list[ScopeTreeNode]] | None = None
+        self._names: dict[str, list[Occurrence]] | None = None
+        # Positions of this node and of the one after its subtree in the
+        # walk() order of the whole tree. Assigned by ScopeTreeRoot.
+        self._span: tuple[int, int] | None = None
+
+    @property
+    def children(self) -> list[ScopeTreeNode]:
+        # Built on first access, one level at a time, so that building a tree
+        # never recurses and subtrees nobody looks at cost nothing.
+        if self._children is None:
+            # The children symbol tables aren't necessarily ordered by their line numbers.
+            # Consider the following code:
+            #
+            #     @lambda func: None
+            #     def same_lineno() -> lambda: None:
+            #         pass
+            #
+            # The decorator lambda will come after the returntype lambda.
+            children = sorted(self.symbols.get_children(), key=lambda s: s.get_lineno())
+            self._children = [ScopeTreeNode(child, self) for child in children]
+        return self._children
+
+    @property
+    def child_names(self) -> list[str]:
+        return [child.name for child in self.children]
+
+    def children_named(self, name: str) -> list[ScopeTreeNode]:
+        """Children with the given name, in order, including the shadowed ones."""
+        if self._children_by_name is None:
+            self._children_by_name = {}
+            for child in self.children:
+                self._children_by_name.setdefault(child.name, []).append(child)
+        return self._children_by_name.get(name, [])
+
+    @property
+    def names(self) -> dict[str, list[Occurrence]]:
+        """Occurrences of each name in this scope, without the nested scopes."""
+        if self._names is None:
+            if self.ast_node is None:
+                self._names = {}
+            else:
+                self._names = index_names(
+                    self.ast_node, self.root.future_annotations, self.class_name
+                )
+        return self._names
+
+    @property
+    def class_name(self) -> str | None:
+        """Name of the innermost class this scope is, or is nested in."""
+        node = self
+        while node is not None and node.kind != "class":
+            node = node.parent
+        return None if node is None else node.name
 
-        # The children symbol tables aren't necessarily ordered by their line numbers.
-        # Consider the following code:
-        #
-        #     @lambda func: None
-        #     def same_lineno() -> lambda: None:
-        #         pass
-        #
-        # The decorator lambda will come after the returntype lambda.
-        children = sorted(symbols.get_children(), key=lambda s: s.get_lineno())
-
-        for child in children:
-            new_node = ScopeTreeNode(child, self)
-            self.children.append(new_node)
-            self.child_names.append(new_node.name)
+    def mangle(self, name: str) -> str:
+        """Name as the symbol table of this scope has it."""
+        return mangle(name, self.class_name)
+
+    @property
+    def root(self) -> ScopeTreeRoot:
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
+    def usages(self, name: str) -> list[Occurrence]:
+        """Occurrences of a name in this scope and the scopes nested in it, in order."""
+        return self.root.subtree_usages(self, name)
+
+    def binding_scope(self, name: str) -> ScopeTreeNode | None:
+        """Scope of the variable that `name` refers to in this scope.
+
+        `None` if this scope has no such symbol.
+        """
+        try:
+            symbol = self.symbols.lookup(name)
+        except KeyError:
+            return None
+        if symbol.is_global():
+            return self.root
+        if not symbol.is_free():
+            return self
+
+        # Free variables, `nonlocal` ones included, are bound in the nearest
+        # enclosing function that has them local. Class bodies are skipped,
+        # their names aren't visible in the scopes nested in them, apart from
+        # the implicit __class__ of methods. Every function on the way has
+        # them as free variables too.
+        enclosing = self.parent
+        while enclosing.parent is not None:
+            if enclosing.kind == "class":
+                if name == "__class__":
+                    return enclosing
+            elif not enclosing.symbols.lookup(name).is_free():
+                return enclosing
+            enclosing = enclosing.parent
+        return enclosing
+
+    def def_use_chain(
+        self, name: str, within: ScopeTreeNode | None = None
+    ) -> DefUseChain | None:
+        """Chain of the variable that `name` refers to in this scope.
+
+        Only the scopes where the name occurs are visited, each one once.
+        With `within`, only references in its subtree are collected. `None`
+        if this scope has no such symbol.
+        """
+        binding = self.binding_scope(name)
+        if binding is None:
+            return None
+        root = self.root
+        if root._scopes_by_name is None:
+            root._index_names()
+
+        definitions: list[Reference] = []
+        uses: list[Reference] = []
+        # Only functions and the module have variables visible in nested
+        # scopes. Those of a function are visible only in its own subtree.
+        subtree = binding if within is None else within
+        if binding.kind != "class":
+            candidates = root._scopes_with_name(subtree, name)
+        elif name == "__class__" and self is not binding:
+            # The implicit cell of the methods, not a name in the class body.
+            candidates = [
+                scope for scope in root._scopes_with_name(subtree, name) if scope is not binding
+            ]
+        else:
+            candidates = [binding] if name in binding.names else []
+        for candidate in candidates:
+            if candidate is not binding and candidate.binding_scope(name) is not binding:
+                continue  # Shadowed, or an unrelated variable of the same name.
+            for occurrence in candidate.names[name]:
+                references = uses if occurrence.ctx == "load" else definitions
+                references.append(Reference(candidate, occurrence))
+
+        definitions.sort(key=lambda reference: reference.occurrence)
+        uses.sort(key=lambda reference: reference.occurrence)
+        return DefUseChain(name, binding, definitions, uses)
+
+    def references(self, name: str) -> list[Occurrence]:
+        """Occurrences in this scope and the scopes nested in it that refer to
+        the same variable as `name` in this scope, in order.
+
+        Unlike usages(), leaves out the names of nested scopes that shadow it.
+        """
+        chain = self.def_use_chain(name, within=self)
+        if chain is None:
+            return []
+        return sorted(reference.occurrence for reference in chain.definitions + chain.uses)
+
+    def walk(self):
+        """Iterate over the subtree nodes.
+
+        Returns the subtree's nodes excluding this one, in the order of their linenos.
+        """
+        stack = [*(reversed(self.children))]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def __str__(self):
         symbols = self.symbols.get_symbols()
@@ -79,10 +291,6 @@ class ScopeTreeNode:
     def name(self) -> str:
         return self.symbols.get_name()
 
-    @property
-    def qualname(self) -> str:
-        return self.parent.qualname + "." + self.name if self.parent is not None else ""
-
     @property
     def kind(self) -> str:
         return self.symbols.get_type()
@@ -91,16 +299,54 @@ class ScopeTreeNode:
     def lineno(self) -> int:
         return self.symbols.get_lineno()
 
-    def tree_str(self) -> str:
-        tree_str = ""
-        for child_idx, child in enumerate(self.children):
-            tree_str += f"\n{child_idx}: {child.tree_str()}"
+    def to_json(self) -> dict:
+        return {
+            "kind": self.kind,
+            "qualname": self.qualname,
+            "lineno": self.lineno,
+            "symbols": [symbol.get_name() for symbol in self.symbols.get_symbols()],
+            "ast": self.ast_node.__class__.__name__ if self.ast_node is not None else None,
+            "ast_lineno": getattr(self.ast_node, "lineno", None),
+        }
 
-        tree_str = textwrap.indent(tree_str, "    ")
-        return f"{self!s}" + tree_str
+    def iter_tree(self):
+        """Yield (depth, child index, node) of the subtree, in tree_str() order.
+
+        The child index of this node is None.
+        """
+        stack = [(0, None, self)]
+        while stack:
+            depth, child_idx, node = stack.pop()
+            yield depth, child_idx, node
+            children = node.children
+            for idx in range(len(children) - 1, -1, -1):
+                stack.append((depth + 1, idx, children[idx]))
+
+    def iter_tree_lines(self):
+        for depth, child_idx, node in self.iter_tree():
+            if child_idx is None:
+                yield f"{node!s}"
+            else:
+                yield f"{'    ' * depth}{child_idx}: {node!s}"
+
+    def write_tree(self, stream, json_lines: bool = False) -> None:
+        """Write the tree_str() lines, or a JSON object per node, to `stream`."""
+        if json_lines:
+            for depth, child_idx, node in self.iter_tree():
+                stream.write(json.dumps({"depth": depth, "index": child_idx, **node.to_json()}))
+                stream.write("\n")
+        else:
+            for line in self.iter_tree_lines():
+                stream.write(line)
+                stream.write("\n")
+
+    def tree_str(self) -> str:
+        return "\n".join(self.iter_tree_lines())
 
 
 class ScopeTreeRoot(ScopeTreeNode):
+    __slots__ = ("path", "future_annotations", "_by_qualname", "_preorder", "_scopes_by_name")
+
     def __init__(
         self,
         symbols: symtable.SymbolTable,
@@ -110,52 +356,107 @@ class ScopeTreeRoot(ScopeTreeNode):
         if path is None:
             path = "<unnamed module>"
         self.path = path
+        self._by_qualname: dict[str, list[ScopeTreeNode]] | None = None
+        self._preorder: list[ScopeTreeNode] | None = None
+        self._scopes_by_name: dict[str, list[int]] | None = None
 
         super().__init__(symbols, None)
 
-        self._find_ast_nodes(ast_tree)
         self.ast_node = ast_tree
+        self.future_annotations = has_future_annotations(ast_tree)
+        self._find_ast_nodes()
 
     def __str__(self):
         return f"Global scope ({self.path})"
 
-    def _find_ast_nodes(self, ast_tree) -> None:
-        # Since scoped expressions violate the ordering between symtable
-        # and ast, we need to take care of them separately.
-        all_nodes = flatten_ast(ast_tree)
-
-        # Take care of functions and classes first:
-        stmt_children = filter(lambda child: child.name not in EXPR_NAMES, self.walk())
-        stmt_nodes = [
-            node for node in all_nodes if isinstance(node, SCOPED_STMT)
-        ]
-
-        for stmt_child, stmt_ast_node in zip(stmt_children, stmt_nodes):
-            stmt_child.ast_node = stmt_ast_node
+    def to_json(self) -> dict:
+        return {**super().to_json(), "path": self.path}
 
-        # Then find ast nodes for the expression scopes:
-        expr_children = filter(lambda child: child.name in EXPR_NAMES, self.walk())
-        expr_nodes = [
-            node for node in all_nodes if isinstance(node, SCOPED_EXPR)
-        ]
-        for expr_child, expr_ast_node in zip(expr_children, expr_nodes):
-            expr_child.ast_node = expr_ast_node
-
-    def walk(self):
-        """Iterate over the subtree nodes.
-
-        Returns the subtree's nodes excluding this one, in the order of their linenos.
-        """
-        stack = [*(reversed(self.children))]
+    def _find_ast_nodes(self) -> None:
+        stack = [self]
         while stack:
-            node = stack.pop()
-            yield node
-            stack.extend(reversed(node.children))
+            scope = stack.pop()
+            stack.extend(scope.children)
+            if scope.ast_node is None:
+                continue
+
+            # Tables of the same line number and name are created in the order
+            # their nodes are visited, which is what the nodes are queued in.
+            queued: dict[tuple[int, str], deque[ast.AST]] = {}
+            for node in child_scope_nodes(scope.ast_node, self.future_annotations):
+                queued.setdefault((node.lineno, scope_name(node)), deque()).append(node)
+
+            children = {child.symbols.get_id(): child for child in scope.children}
+            # Unlike scope.children, get_children() isn't sorted by line number.
+            for table in scope.symbols.get_children():
+                nodes = queued.get((table.get_lineno(), table.get_name()))
+                if nodes:
+                    children[table.get_id()].ast_node = nodes.popleft()
 
     @property
     def name(self) -> str:
         return "."
 
+    def find_qualname(self, qualname: str) -> list[ScopeTreeNode]:
+        """Scopes with the given qualname, in order, including the shadowed ones."""
+        if self._by_qualname is None:
+            self._by_qualname = {self.qualname: [self]}
+            for node in self.walk():
+                self._by_qualname.setdefault(node.qualname, []).append(node)
+        return self._by_qualname.get(qualname, [])
+
+    def _index_names(self) -> None:
+        preorder = [self, *self.walk()]
+        scopes_by_name: dict[str, list[int]] = {}
+        for position, scope in enumerate(preorder):
+            for name in scope.names:
+                scopes_by_name.setdefault(name, []).append(position)
+
+        # Children come after their parent, so their spans are known by then.
+        for position in range(len(preorder) - 1, -1, -1):
+            scope = preorder[position]
+            end = scope.children[-1]._span[1] if scope.children else position + 1
+            scope._span = (position, end)
+        self._preorder = preorder
+        self._scopes_by_name = scopes_by_name
+
+    def subtree_usages(self, scope: ScopeTreeNode, name: str) -> list[Occurrence]:
+        """Occurrences of a name within the AST node of `scope`, in order.
+
+        These are the ones in the scope, in the scopes nested in it, and in
+        the parts of its node that belong to the enclosing scope, like
+        decorators, default values and the name of a function.
+        """
+        if self._scopes_by_name is None:
+            self._index_names()
+        occurrences = self._nested_usages(scope, name)
+        parent = scope.parent
+        if parent is not None and scope.ast_node is not None:
+            # Scopes created in those parts, like lambdas among the default
+            # values, are siblings of `scope`.
+            occurrences.append(_within(parent.names.get(name, []), scope.ast_node))
+            for sibling in parent.children:
+                if (
+                    sibling is not scope
+                    and sibling.ast_node is not None
+                    and _encloses(scope.ast_node, sibling.ast_node)
+                ):
+                    occurrences += self._nested_usages(sibling, name)
+        if len(occurrences) == 1:
+            return list(occurrences[0])
+        return list(heapq.merge(*occurrences))
+
+    def _scopes_with_name(self, scope: ScopeTreeNode, name: str) -> list[ScopeTreeNode]:
+        """Scopes in the subtree of `scope` in which the name occurs, in walk() order."""
+        positions = self._scopes_by_name.get(name, [])
+        start, end = scope._span
+        scopes = positions[bisect_left(positions, start) : bisect_left(positions, end)]
+        return [self._preorder[position] for position in scopes]
+
+    def _nested_usages(self, scope: ScopeTreeNode, name: str) -> list[list[Occurrence]]:
+        """Occurrences of a name in each scope of the subtree of `scope` that has any."""
+        return [nested.names[name] for nested in self._scopes_with_name(scope, name)]
+
     @classmethod
     def from_file(cls, path: str) -> ScopeTreeRoot:
         with open(path, "r", encoding="utf-8") as f:
@@ -165,14 +466,19 @@ class ScopeTreeRoot(ScopeTreeNode):
         return ScopeTreeRoot(symbols, ast_tree, path)
 
 
-USAGE = f"Usage: {sys.argv[0]} <path>"
-MAXARGS = 2
+USAGE = f"Usage: {sys.argv[0]} [--json] <path>"
+MAXARGS = 3
 MINARGS = 2
 
 
 def main(args: list[str]):
-    path = args[0]
-    print(ScopeTreeRoot.from_file(path).tree_str())
+    json_lines = args[0] == "--json"
+    if json_lines:
+        args.pop(0)
+    if len(args) != 1:
+        print(USAGE)
+        sys.exit(1)
+    ScopeTreeRoot.from_file(args[0]).write_tree(sys.stdout, json_lines)
 
 
 if __name__ == "__main__":
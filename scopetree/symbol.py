@@ -1,18 +1,22 @@
 #!/bin/env python
 """
 Given a file, scope, and a symbol name, finds all usage of the specified symbol
-in the scope.
+in the scope, including the nested scopes that refer to the same variable.
+
+Run as symbol_batch, reads many such queries about one file from stdin and
+answers all of them with a single parse.
 """
 
 from __future__ import annotations
 
+import json
 import linecache
 import re
 import sys
 from symtable import Symbol
+from typing import Iterable
 
-from flatten_ast import flatten_ast
-from scopetree_with_ast import ScopeTreeNode, ScopeTreeRoot
+from scopetree_with_ast import Occurrence, ScopeTreeNode, ScopeTreeRoot
 
 SYMBOL_ATTRS = sorted(
     attr_name for attr_name in dir(Symbol) if attr_name.startswith("is_")
@@ -49,13 +53,48 @@ def find_subscope(scope: ScopeTreeNode, scope_id: str) -> ScopeTreeNode | None:
     try:
         scope_idx = int(scope_id)
     except ValueError:  # Not an integer id
-        try:
-            scope_idx = scope.child_names.index(scope_id)
-        except ValueError:  # Not found
-            return None
+        children = scope.children_named(scope_id)
+        return children[0] if children else None
     return scope.children[scope_idx]
 
 
+def batch_usages(
+    scope_tree_root: ScopeTreeRoot, queries: Iterable[tuple[str, str]]
+) -> list[list[Occurrence] | None]:
+    """Usages of the symbols in the scopes of (scope, symbol name) queries.
+
+    Answers with `None` for queries about a missing scope or symbol.
+    """
+    scopes: dict[str, ScopeTreeNode | None] = {}
+    results = []
+    for scope_path, symbol_name in queries:
+        if scope_path not in scopes:
+            try:
+                scopes[scope_path] = scope_traverse(scope_tree_root, scope_path)
+            except IndexError:  # Child index out of range
+                scopes[scope_path] = None
+        scope = scopes[scope_path]
+        try:
+            symbol_name = scope.mangle(symbol_name)
+            scope.symbols.lookup(symbol_name)
+        except (AttributeError, KeyError):  # No such scope or symbol
+            results.append(None)
+            continue
+        results.append(scope.references(symbol_name))
+    return results
+
+
+def batch_main(path: str) -> None:
+    queries = [tuple(line.split()) for line in sys.stdin if line.strip()]
+    if any(len(query) != 2 for query in queries):
+        print(BATCH_USAGE, end="")
+        sys.exit(1)
+
+    scope_tree = ScopeTreeRoot.from_file(path)
+    for usages in batch_usages(scope_tree, queries):
+        print(json.dumps(usages))
+
+
 USAGE = f"""\
 Usage: {sys.argv[0]} <path> <scope> <symbol>"
 
@@ -65,6 +104,13 @@ or "." to get the global scope.
 """
 MAXARGS = 4
 MINARGS = 4
+BATCH_USAGE = f"""\
+Usage: {sys.argv[0]} <path>
+
+Reads "<scope> <symbol>" queries from stdin, one per line, and prints
+a JSON list of [lineno, col_offset, ctx] usages for each of them,
+or null if the scope or the symbol doesn't exist.
+"""
 ANSI_BOLD_YELLOW = "\033[1;31m"
 ANSI_RESET = "\033[0m"
 ANSI_GREY = "\033[90m"
@@ -82,25 +128,15 @@ def main(args: list[str]):
         print(f"Scope not found: {scope_path!r}")
         sys.exit(1)
 
+    # Private names are mangled within classes.
+    table_name = target_scope.mangle(symbol_name)
     try:
-        symbol = target_scope.symbols.lookup(symbol_name)
+        symbol = target_scope.symbols.lookup(table_name)
     except KeyError:
         print(f"Scope {scope_path!r} does not contain symbol {symbol_name!r}")
         sys.exit(1)
 
-    ast_nodes = flatten_ast(target_scope.ast_node)
-    lines = [
-        node.lineno
-        for node in ast_nodes
-        if (
-            hasattr(node, "id")
-            and node.id == symbol_name
-            or hasattr(node, "arg")
-            and node.arg == symbol_name
-            or hasattr(node, "name")
-            and node.name == symbol_name
-        )
-    ]
+    lines = [usage.lineno for usage in target_scope.references(table_name)]
 
     if exec == "symbol_usage":
         print(symbol_summary(symbol))
@@ -121,7 +157,7 @@ def main(args: list[str]):
             print(f"At line {lineno}:\n\t{line}")
 
     elif exec == "symbol_code":
-        ruler_width = len(str(max(lines)))
+        ruler_width = len(str(max(lines, default=0)))
 
         for lineno in lines:
             line = linecache.getline(path, lineno)
@@ -139,6 +175,13 @@ def main(args: list[str]):
 
 
 if __name__ == "__main__":
+    if sys.argv[0].removeprefix("./") == "symbol_batch":
+        if len(sys.argv) != 2:
+            print(BATCH_USAGE, end="")
+            sys.exit(1)
+        batch_main(sys.argv[1])
+        sys.exit(0)
+
     if not (MINARGS <= len(sys.argv) <= MAXARGS):
         print(USAGE, end="")
         sys.exit(1)